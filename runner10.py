@@ -11,21 +11,35 @@ submits) the forced login user and prevents editing when a playbook requires a f
 
 Other behavior is preserved from the original script (report browsing, masked command,
 ANSIBLE env isolation, etc.). Python 3.7+ compatible.
+
+Runs as a plain CGI script, or as a long-lived WSGI app via `application`
+(inventory and report caches, compiled tables and imports then survive between requests):
+    WSGIDaemonProcess ansible-runner processes=2 threads=8
+    WSGIScriptAlias /runner10 /var/www/cgi-bin/runner10.py process-group=ansible-runner
 """
 
-import cgi
-import cgitb
+import functools
+import hashlib
+import heapq
 import html
+import io
+import itertools
+import json
+import operator
 import os
+import queue
 import re
 import shutil
+import signal
+import string
 import subprocess
 import sys
+import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from urllib.parse import quote
-
-cgitb.enable()
+from urllib.parse import parse_qsl, quote
 
 # ---------------- CONFIG ----------------
 # Each playbook can define:
@@ -61,21 +75,36 @@ INVENTORIES = {
 REPORT_BASES = [
     "/var/www/cgi-bin/reports",
 ]
+# Subdirectories never descended into while scanning for reports (plus any
+# dot-directory), and how many levels below a base the scan goes.
+REPORT_IGNORE_DIRS = {"node_modules", "__pycache__"}
+REPORT_MAX_DEPTH = 6
+REPORT_CACHE_TTL = 30   # seconds a find_reports walk is reused
+REPORT_CACHE_SIZE = 32
+# REPORT_BASES resolved once (same order), for the containment check in serve_report
+_REPORT_BASES_REAL = [os.path.realpath(b) for b in REPORT_BASES]
+
+def _find_bin(name: str, default: str) -> str:
+    """The usual install path if it is there (one access() call); a PATH search only if not."""
+    if os.access(default, os.X_OK):
+        return default
+    return shutil.which(name) or default
 
-ANSIBLE_BIN = shutil.which("ansible-playbook") or "/usr/bin/ansible-playbook"
+ANSIBLE_BIN = _find_bin("ansible-playbook", "/usr/bin/ansible-playbook")
 DEFAULT_USER = os.environ.get("ANSIBLE_SSH_USER", "ansadmin")
 RUN_TIMEOUT_SECS = 3600
 USE_SUDO = False
-SUDO_BIN = shutil.which("sudo") or "/usr/bin/sudo"
+SUDO_BIN = _find_bin("sudo", "/usr/bin/sudo")
+MAX_FORM_BYTES = 4 * 1024 * 1024
 
 # Writable HOME/TMP for the web user (apache/www-data)
 RUN_HOME = "/var/lib/www-ansible/home"
 RUN_TMP  = "/var/lib/www-ansible/tmp"
 
-# Validators
-HOST_RE = re.compile(r"^[A-Za-z0-9_.-]+$")
-USER_RE = re.compile(r"^[A-Za-z0-9_.-]+$")
-TAGS_RE = re.compile(r"^[A-Za-z0-9_,.-]+$")
+# Validators: allowed characters as translate() deletion tables (valid = nothing left)
+_NAME_CHARS = string.ascii_letters + string.digits + "_.-"
+_NAME_DEL = str.maketrans("", "", _NAME_CHARS)
+_LIST_DEL = str.maketrans("", "", _NAME_CHARS + ",")
 
 # ---------------- UTIL ----------------
 def header_ok(ct="text/html; charset=utf-8"):
@@ -85,20 +114,78 @@ def header_ok(ct="text/html; charset=utf-8"):
 def safe(s: str) -> str:
     return html.escape("" if s is None else str(s))
 
-def _realpath(p: str) -> str:
-    return os.path.realpath(p)
+class Form(dict):
+    """Minimal stand-in for cgi.FieldStorage: {name: [values]} with getfirst/getlist."""
+
+    def getfirst(self, key, default=None):
+        values = self.get(key)
+        return values[0] if values else default
+
+    def getlist(self, key):
+        return list(self.get(key, ()))
+
+def parse_form(environ, stream):
+    """Parse an urlencoded POST body plus QUERY_STRING (no file uploads needed).
+
+    Returns None for a body over MAX_FORM_BYTES; the caller answers 413.
+    """
+    pairs = []
+    if environ.get("REQUEST_METHOD", "GET").upper() == "POST":
+        try:
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            length = 0
+        if length > MAX_FORM_BYTES:
+            return None
+        if length > 0:
+            pairs += parse_qsl(stream.read(length).decode("utf-8", "replace"))
+    pairs += parse_qsl(environ.get("QUERY_STRING", ""))
+    form = Form()
+    for k, v in pairs:
+        form.setdefault(k, []).append(v)
+    return form
+
+def is_name(s: str) -> bool:
+    """Host or SSH user name."""
+    return bool(s) and not s.translate(_NAME_DEL)
+
+def is_name_list(s: str) -> bool:
+    """Comma-separated names (--tags)."""
+    return bool(s) and not s.translate(_LIST_DEL)
+
+def first_bad_host(hosts):
+    """Return the first invalid name in hosts, or None if all are valid."""
+    if "" not in hosts and ",".join(hosts).translate(_NAME_DEL) == "," * (len(hosts) - 1):
+        return None
+    return next((h for h in hosts if not is_name(h)), None)
 
-def _is_under(base: str, target: str) -> bool:
-    base_r = _realpath(base)
-    tgt_r  = _realpath(target)
+def _unlink_quiet(path):
+    if path:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+def _is_under(base_r: str, target: str) -> bool:
+    """True if target resolves to base_r (an already-resolved path) or below it."""
+    tgt_r = os.path.realpath(target)
     return tgt_r == base_r or tgt_r.startswith(base_r + os.sep)
 
 def parse_ini_inventory_groups(path: str):
-    """Parse very simple INI inventory into {group: [hosts]}."""
+    """Parse very simple INI inventory into ({group: [hosts]}, {host: [groups]}).
+
+    Groups and each group's hosts keep file order; each host's groups are
+    sorted case-insensitively.
+
+    One pass: hash membership instead of list scans (dicts used as ordered
+    sets keep first-seen order for case-insensitive ties), and the
+    host -> groups inverse is filled in the same loop.
+    """
     groups = {}
+    host_groups = {}
     current = None
     if not os.path.exists(path):
-        return {}
+        return {}, {}
     with open(path, "r") as f:
         for raw in f:
             line = raw.strip()
@@ -106,72 +193,217 @@ def parse_ini_inventory_groups(path: str):
                 continue
             if line.startswith("[") and line.endswith("]"):
                 current = line[1:-1].strip()
-                groups.setdefault(current, [])
+                members = groups.setdefault(current, {})
                 continue
             if current:
                 token = line.split()[0].split("=")[0].strip()
-                if token:
-                    if token not in groups[current]:
-                        groups[current].append(token)
+                if token and token not in members:
+                    members[token] = None
+                    host_groups.setdefault(token, []).append(current)
     for k in ("all", "ungrouped"):
         if k in groups and not groups[k]:
             groups.pop(k, None)
-    for k in groups:
-        groups[k] = sorted(groups[k], key=str.lower)
-    return dict(sorted(groups.items(), key=lambda kv: kv[0].lower()))
+    # Groups and their members stay in file order: render_form sorts the group
+    # names for display and only needs each member count.
+    for k, members in groups.items():
+        groups[k] = list(members)
+    for gs in host_groups.values():
+        gs.sort(key=str.lower)
+    return groups, host_groups
+
+# path -> ((st_mtime_ns, st_size, st_ino), (groups_map, all_hosts, host_groups));
+# at most one entry per configured inventory.
+_INV_CACHE = {}
+_INV_CACHE_LOCK = threading.Lock()
 
 def get_inventory_maps(inv_key: str):
-    """From inventory key -> (groups_map, all_hosts_sorted, host->groups map)."""
+    """From inventory key -> (groups_map, all_hosts_sorted, host->groups map).
+
+    Re-parsed only when the file changes (mtime, size or inode); callers must
+    not mutate the cached result.
+    """
     meta = INVENTORIES.get(inv_key or "", {})
     path = meta.get("path", "")
     if not path:
         return {}, [], {}
-    groups_map = parse_ini_inventory_groups(path)
-    host_groups = {}
-    for g, hosts in groups_map.items():
-        for h in hosts:
-            host_groups.setdefault(h, []).append(g)
-    all_hosts = sorted(host_groups.keys(), key=str.lower)
+    try:
+        st = os.stat(path)
+    except OSError:
+        with _INV_CACHE_LOCK:
+            _INV_CACHE.pop(path, None)
+        return {}, [], {}
+    sig = (st.st_mtime_ns, st.st_size, st.st_ino)
+    cached = _INV_CACHE.get(path)
+    if cached and cached[0] == sig:
+        return cached[1]
+    result = _load_inv_digest(path, sig)
+    if result is None:
+        groups_map, host_groups = parse_ini_inventory_groups(path)
+        all_hosts = sorted(host_groups, key=str.lower)
+        result = (groups_map, all_hosts, host_groups)
+        _save_inv_digest(path, sig, result)
+    with _INV_CACHE_LOCK:
+        _INV_CACHE[path] = (sig, result)
+    return result
+
+# Parsed inventories also persist as JSON digests under RUN_TMP, so a fresh
+# CGI process loads one small file instead of re-parsing the INI. The file
+# name carries the signature: a changed inventory simply misses.
+def _inv_digest_prefix(path):
+    return "inv-%s-" % hashlib.sha1(path.encode("utf-8", "surrogateescape")).hexdigest()[:16]
+
+def _load_inv_digest(path, sig):
+    name = "%s%d-%d-%d.json" % ((_inv_digest_prefix(path),) + sig)
+    try:
+        with open(os.path.join(RUN_TMP, name), "rb") as f:
+            groups_map, all_hosts, host_groups = json.loads(f.read())
+    except (OSError, ValueError):
+        return None
     return groups_map, all_hosts, host_groups
 
+def _save_inv_digest(path, sig, result):
+    prefix = _inv_digest_prefix(path)
+    name = "%s%d-%d-%d.json" % ((prefix,) + sig)
+    try:
+        fd, tmp = tempfile.mkstemp(prefix=".inv-", dir=RUN_TMP)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(result, f, separators=(",", ":"))
+        os.replace(tmp, os.path.join(RUN_TMP, name))
+        # Digests of older versions of this inventory are dead weight now.
+        with os.scandir(RUN_TMP) as it:
+            stale = [e.path for e in it if e.name.startswith(prefix) and e.name != name]
+        for p in stale:
+            _unlink_quiet(p)
+    except OSError:
+        pass  # best effort: the in-process cache still holds the result
+
 # ---------- Reports ----------
-def find_reports(hosts, since_ts, limit=200):
-    """Scan REPORT_BASES for .html files modified since since_ts."""
-    out = []
-    needles = [h.lower() for h in (hosts or [])]
-    for base in REPORT_BASES:
-        if not os.path.isdir(base):
-            continue
-        for root, _, files in os.walk(base):
-            for fn in files:
-                if not fn.lower().endswith(".html"):
+# Date-named report directories: YYYY, YYYY-MM, YYYY-MM-DD / YYYYMMDD at the
+# top of a base, or YYYY/MM/DD split over levels.
+_DATE_DIR_RE = re.compile(r"(\d{4})(?:-?(\d{2})(?:-?(\d{2}))?)?")
+_DATE_PART_RE = re.compile(r"\d{2}")
+
+def _date_dir(name, parent_parts):
+    """(year[, month[, day]]) named by a report directory, or None if not a date."""
+    if not parent_parts:
+        m = _DATE_DIR_RE.fullmatch(name)
+        parts = tuple(int(x) for x in m.groups() if x) if m else None
+    elif len(parent_parts) < 3 and _DATE_PART_RE.fullmatch(name):
+        parts = parent_parts + (int(name),)
+    else:
+        return None
+    if (parts and 1990 <= parts[0] <= 2999 and (len(parts) < 2 or 1 <= parts[1] <= 12)
+            and (len(parts) < 3 or 1 <= parts[2] <= 31)):
+        return parts
+    return None
+
+def _scan_reports(base, top, since_ts, host_re, depth=0, rel_dir="", since_day=None, date_parts=()):
+    """Yield .html files under top: os.scandir, files before subdirs like os.walk.
+
+    rel_dir is top relative to base ("" or ending in os.sep), carried down the
+    recursion so each report's rel is one concatenation, not a relpath().
+    Date-named directories (see _date_dir) that end before since_day are not
+    entered; anything else is walked as usual.
+    """
+    if since_day is None:
+        # One day of slack: directory dates may be UTC or local time.
+        since_day = time.localtime(since_ts - 86400)[:3]
+    subdirs = []
+    descend = depth < REPORT_MAX_DEPTH
+    try:
+        it = os.scandir(top)
+    except OSError:
+        return
+    with it:
+        for entry in it:
+            try:
+                # d_type from the directory read: no stat for directories or skipped names
+                if entry.is_dir():
+                    name = entry.name
+                    if (descend and not entry.is_symlink()  # os.walk does not follow dir symlinks either
+                            and not name.startswith(".") and name not in REPORT_IGNORE_DIRS):
+                        parts = _date_dir(name, date_parts) if depth < 3 else None
+                        if parts and parts < since_day[:len(parts)]:
+                            continue  # dated before the window: nothing recent inside
+                        subdirs.append((entry.path, rel_dir + name + os.sep, parts or ()))
                     continue
-                full = os.path.join(root, fn)
-                try:
-                    st = os.stat(full)
-                except OSError:
+                # Name checks first: only candidate reports cost a stat().
+                fn = entry.name
+                lo = fn.lower()
+                if not lo.endswith(".html"):
                     continue
-                if st.st_mtime < since_ts:
+                if host_re is not None and not host_re.search(lo):
                     continue
-                if needles:
-                    lo = fn.lower()
-                    if not any(n in lo for n in needles):
-                        continue
-                rel = os.path.relpath(full, base)
-                out.append({"base": base, "rel": rel, "path": full, "mtime": st.st_mtime})
-    out.sort(key=lambda x: x["mtime"], reverse=True)
-    return out[:limit]
+                st = entry.stat()
+            except OSError:
+                continue
+            if st.st_mtime < since_ts:
+                continue
+            yield {"base": base, "rel": rel_dir + fn, "path": entry.path, "mtime": st.st_mtime}
+    for d, d_rel, d_parts in subdirs:
+        yield from _scan_reports(base, d, since_ts, host_re, depth + 1, d_rel, since_day, d_parts)
+
+_by_mtime = operator.itemgetter("mtime")
+
+def _scan_base(base, host_re, since_ts, limit):
+    """Newest-first reports under one base, capped at limit.
+
+    nlargest keeps a bounded heap of limit entries while the walk streams in:
+    O(n log limit), and it is stable for equal mtimes like the sort it replaces.
+    """
+    return heapq.nlargest(limit, _scan_reports(base, base, since_ts, host_re), key=_by_mtime)
+
+def _walk_reports(needles, since_ts, limit):
+    # One alternation searched in C instead of a Python any() per file name.
+    host_re = re.compile("|".join(map(re.escape, needles))) if needles else None
+    if len(REPORT_BASES) < 2:
+        return [r for base in REPORT_BASES for r in _scan_base(base, host_re, since_ts, limit)]
+    # readdir/stat release the GIL: walk separate mounts concurrently.
+    with ThreadPoolExecutor(max_workers=min(8, len(REPORT_BASES))) as pool:
+        parts = pool.map(lambda b: _scan_base(b, host_re, since_ts, limit), REPORT_BASES)
+        return heapq.nlargest(limit, itertools.chain.from_iterable(parts), key=_by_mtime)
+
+# (needles, since minute, limit) -> (walked_at, newest-first reports)
+_REPORT_CACHE = {}
+_REPORT_CACHE_LOCK = threading.Lock()
+
+def find_reports(hosts, since_ts, limit=200, fresh=False):
+    """Scan REPORT_BASES for .html files modified since since_ts.
+
+    Walks are cached for REPORT_CACHE_TTL seconds per minute-bucketed since_ts,
+    so page refreshes skip the filesystem; fresh=True forces a new walk.
+    """
+    needles = tuple(sorted({h.lower() for h in (hosts or [])}))
+    bucket = int(since_ts // 60) * 60
+    key = (needles, bucket, limit)
+    now = time.time()
+    hit = None if fresh else _REPORT_CACHE.get(key)
+    if hit is None or now - hit[0] > REPORT_CACHE_TTL:
+        hit = (now, tuple(_walk_reports(needles, bucket, limit)))
+        with _REPORT_CACHE_LOCK:
+            _REPORT_CACHE.pop(key, None)
+            _REPORT_CACHE[key] = hit
+            while len(_REPORT_CACHE) > REPORT_CACHE_SIZE:
+                del _REPORT_CACHE[next(iter(_REPORT_CACHE))]
+    # The bucket floors since_ts, so trim the newest-first list back to the exact cutoff.
+    return [r for r in hit[1] if r["mtime"] >= since_ts]
+
+@functools.lru_cache(maxsize=4096)
+def _report_item(bidx, rel, mtime_s):
+    """One report <li>; memoized, so a resident process re-lists the same reports for free."""
+    ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(mtime_s))
+    return f'<li><a href="?action=view_report&b={bidx}&p={quote(rel)}" target="_blank">{safe(rel)} — {ts}</a></li>'
 
 def render_reports_list(title, reports, extra_note=""):
     items = []
+    bidx_of = {}
+    for i, b in enumerate(REPORT_BASES):
+        bidx_of.setdefault(b, i)  # first index wins, as list.index did
     for r in reports:
-        try:
-            bidx = REPORT_BASES.index(r["base"])
-        except ValueError:
+        bidx = bidx_of.get(r["base"])
+        if bidx is None:
             continue
-        href = "?action=view_report&b=%d&p=%s" % (bidx, quote(r["rel"]))
-        ts   = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(r["mtime"]))
-        items.append('<li><a href="%s" target="_blank">%s — %s</a></li>' % (href, safe(r["rel"]), ts))
+        items.append(_report_item(bidx, r["rel"], int(r["mtime"])))
     if not items:
         ul = "<p class='muted'>No matching reports found.</p>"
     else:
@@ -194,21 +426,54 @@ def serve_report(form):
 
     base = REPORT_BASES[b]
     full = os.path.join(base, rel)
-    if not _is_under(base, full) or not os.path.isfile(full):
+    if not _is_under(_REPORT_BASES_REAL[b], full) or not os.path.isfile(full):
         header_ok()
         print("<pre>File not found or not allowed.</pre>")
         return
 
     try:
-        with open(full, "r", encoding="utf-8", errors="replace") as f:
-            data = f.read()
+        f = open(full, "rb")
     except Exception as e:
         header_ok()
         print("<pre>%s</pre>" % safe(str(e)))
         return
 
-    header_ok("text/html; charset=utf-8")
-    print(data)
+    # Pass the bytes through untouched: no decode, no whole-file string.
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        print("Content-Type: text/html; charset=utf-8")
+        print("Content-Length: %d" % size)
+        print()
+        sys.stdout.flush()
+        _send_file(f, size)
+
+def _send_file(src, size):
+    """Copy `size` bytes of src to stdout: os.sendfile when stdout is a real fd
+    (CGI), else 64 KiB reads (WSGI)."""
+    out = sys.stdout.buffer
+    sent = 0
+    try:
+        out_fd = out.fileno()
+    except (AttributeError, OSError):
+        out_fd = None
+    if out_fd is not None:
+        try:
+            while sent < size:
+                n = os.sendfile(out_fd, src.fileno(), sent, size - sent)
+                if n == 0:
+                    break
+                sent += n
+            return
+        except OSError:
+            if sent:
+                raise  # part of the body is already out; cannot switch methods now
+    src.seek(sent)
+    while sent < size:
+        block = src.read(min(65536, size - sent))
+        if not block:
+            break
+        out.write(block)
+        sent += len(block)
 
 def list_reports_page(form):
     """Simple browser to list recent reports (last 24h by default)."""
@@ -271,15 +536,96 @@ def list_reports_page(form):
     print(html_out)
 
 # ---------------- RENDER (FORM) ----------------
-def render_form(msg: str = "", form: cgi.FieldStorage = None):
+# Static <head> of the form page (CSS + JS); only the body varies per request.
+_FORM_HEAD = """<!DOCTYPE html>
+<html>
+<head>
+  <meta charset="utf-8" />
+  <title>Ansible Playbook CGI Runner</title>
+  <style>
+    body { font-family: system-ui, -apple-system, Segoe UI, Roboto, Arial, sans-serif; margin: 24px; }
+    .card { max-width: 900px; margin: auto; padding: 20px; border: 1px solid #ddd; border-radius: 12px; box-shadow: 0 2px 6px rgba(0,0,0,.05); }
+    h1 { margin-top: 0; }
+    label { display:block; margin: 12px 0 6px; font-weight: 700; font-size: 14px; letter-spacing:.2px; }
+    select, input[type=text], input[type=password] { width: 100%; padding: 10px; border: 1px solid #ccc; border-radius: 8px; font-size:16px; }
+    .row { display: grid; grid-template-columns: 1fr 1fr; gap: 16px; }
+    .muted { color: #666; font-size: 0.95em; }
+    .warn { background: #fff3cd; border: 1px solid #ffeeba; padding: 8px 12px; border-radius: 8px; }
+    .group-grid { display: grid; grid-template-columns: repeat(3, minmax(0, 1fr)); grid-gap: 8px; }
+    .hosts-box { max-height: 260px; overflow-y: auto; padding: 8px; border: 1px solid #eee; border-radius: 8px; background:#fff; }
+    .toolbar { display:flex; gap:8px; margin: 6px 0 10px; }
+    .tbtn { padding:6px 10px; border:1px solid #ccc; border-radius:6px; background:#f8f9fa; cursor:pointer; }
+    pre { background: #0b1020; color: #d1e7ff; padding: 12px; border-radius: 8px; overflow-x: auto; white-space: pre-wrap; }
+
+    /* Unified buttons */
+    .actions { display:flex; gap:16px; margin-top:16px; align-items:center; }
+    .btn, .btn:link, .btn:visited {
+      display:inline-flex; align-items:center; justify-content:center;
+      height:48px; padding:0 22px; font-weight:700; font-size:20px; line-height:1;
+      color:#fff; background:#0d6efd; border:0; border-radius:16px; text-decoration:none; cursor:pointer;
+      box-shadow:0 1px 2px rgba(0,0,0,.06), 0 4px 14px rgba(13,110,253,.25);
+      transition:background .15s ease, transform .02s ease; -webkit-appearance:none; appearance:none;
+    }
+    button.btn { border:0; }
+    .btn:hover { background:#0b5ed7; }
+    .btn:active { transform:translateY(1px); }
+    .btn:focus { outline:none; box-shadow:0 0 0 4px rgba(13,110,253,.25); }
+  </style>
+  <script>
+    function selectAllHosts(val) {
+      var boxes = document.querySelectorAll('input[name="hosts"]');
+      for (var i=0; i<boxes.length; i++) { boxes[i].checked = val; }
+    }
+    function toggleInventorySubmit() {
+      document.getElementById('action').value = 'refresh';
+      document.getElementById('runnerForm').submit();
+    }
+    function onPlaybookChanged() {
+      // When playbook changes, refresh to re-filter inventories and suggested/forced user
+      document.getElementById('action').value = 'refresh';
+      document.getElementById('runnerForm').submit();
+    }
+    function syncRegionToHosts() {
+      var selected = new Set();
+      var r = document.querySelectorAll('input[name="regions"]:checked');
+      for (var i=0;i<r.length;i++) selected.add(r[i].value);
+      var hosts = document.querySelectorAll('input[name="hosts"]');
+      for (var j=0;j<hosts.length;j++) {
+        var cb = hosts[j];
+        var groups = (cb.getAttribute('data-groups') || '').split(',');
+        var match = false;
+        for (var k=0;k<groups.length;k++) {
+          if (selected.has(groups[k])) { match = true; break; }
+        }
+        if (selected.size > 0) {
+          cb.checked = match;
+        }
+      }
+    }
+    document.addEventListener('DOMContentLoaded', function() {
+      var regionCbs = document.querySelectorAll('input[name="regions"]');
+      for (var i=0;i<regionCbs.length;i++) {
+        regionCbs[i].addEventListener('change', syncRegionToHosts);
+      }
+      syncRegionToHosts();
+    });
+  </script>
+</head>
+"""
+
+# Config keys and labels are fixed at deploy time: escape them once at import.
+_PLAYBOOK_CHOICES = [(k, safe(k), safe(v["label"])) for k, v in PLAYBOOKS.items()]
+_INVENTORY_CHOICES = {k: (safe(k), safe(v["label"])) for k, v in INVENTORIES.items()}
+
+def render_form(msg: str = "", form: Form = None):
     header_ok()
     if form is None:
-        form = cgi.FieldStorage()
+        form = Form()
 
     selected_playbook = form.getfirst("playbook", "")
     inventory_key     = form.getfirst("inventory_key", "")
-    selected_regions  = form.getlist("regions")
-    posted_hosts      = form.getlist("hosts")
+    selected_regions  = frozenset(form.getlist("regions"))  # sets: O(1) "checked" lookups per row
+    posted_hosts      = frozenset(form.getlist("hosts"))
 
     # Filter inventories based on selected playbook
     if selected_playbook in PLAYBOOKS:
@@ -292,39 +638,38 @@ def render_form(msg: str = "", form: cgi.FieldStorage = None):
     # Build dropdowns (labels only; hide paths)
     playbook_opts = "\n".join(
         '<option value="{k}" {sel}>{lbl}</option>'.format(
-            k=safe(k), lbl=safe(v["label"]), sel=("selected" if k == selected_playbook else "")
+            k=k_html, lbl=lbl_html, sel=("selected" if k == selected_playbook else "")
         )
-        for k, v in PLAYBOOKS.items()
+        for k, k_html, lbl_html in _PLAYBOOK_CHOICES
     )
     inv_opts = "\n".join(
         '<option value="{k}" {sel}>{lbl}</option>'.format(
-            k=safe(k), lbl=safe(INVENTORIES[k]["label"]), sel=("selected" if k == inventory_key else "")
+            k=_INVENTORY_CHOICES[k][0], lbl=_INVENTORY_CHOICES[k][1], sel=("selected" if k == inventory_key else "")
         )
-        for k in allowed_invs
-        if k in INVENTORIES
+        for k in allowed_invs if k in _INVENTORY_CHOICES
     )
 
     # Regions checklist
     if groups_map:
-        regions_html = "\n".join(
-            '<label><input type="checkbox" name="regions" value="{g}" {chk}/> {g} ({n})</label>'.format(
-                g=safe(group), n=len(groups_map[group]), chk=("checked" if group in selected_regions else "")
-            )
-            for group in groups_map
-        )
+        region_parts = []
+        for group in sorted(groups_map, key=str.lower):
+            members = groups_map[group]
+            g = safe(group)  # escaped once, used twice
+            chk = "checked" if group in selected_regions else ""
+            region_parts.append(f'<label><input type="checkbox" name="regions" value="{g}" {chk}/> {g} ({len(members)})</label>')
+        regions_html = "\n".join(region_parts)
     else:
         regions_html = "<p class='muted'>No regions to show. Select an inventory first.</p>"
 
     # Hosts list (scrollable)
     if all_hosts:
-        hosts_html = "\n".join(
-            '<label><input type="checkbox" name="hosts" value="{h}" data-groups="{gs}" {chk}/> {h}</label>'.format(
-                h=safe(h),
-                gs=safe(",".join(host_groups.get(h, []))),
-                chk=("checked" if posted_hosts and h in posted_hosts else "")
-            )
-            for h in all_hosts
-        )
+        host_parts = []
+        for h in all_hosts:
+            h_safe = safe(h)
+            gs = safe(",".join(host_groups.get(h, ())))
+            chk = "checked" if h in posted_hosts else ""
+            host_parts.append(f'<label><input type="checkbox" name="hosts" value="{h_safe}" data-groups="{gs}" {chk}/> {h_safe}</label>')
+        hosts_html = "\n".join(host_parts)
     else:
         hosts_html = "<p class='muted'>No hosts to show.</p>"
 
@@ -356,81 +701,7 @@ def render_form(msg: str = "", form: cgi.FieldStorage = None):
     become_val = "checked" if (form.getfirst("become") or not form) else ""
     msg_html   = ("<div class='warn'>{}</div>".format(safe(msg))) if msg else ""
 
-    html_out = """<!DOCTYPE html>
-<html>
-<head>
-  <meta charset="utf-8" />
-  <title>Ansible Playbook CGI Runner</title>
-  <style>
-    body {{ font-family: system-ui, -apple-system, Segoe UI, Roboto, Arial, sans-serif; margin: 24px; }}
-    .card {{ max-width: 900px; margin: auto; padding: 20px; border: 1px solid #ddd; border-radius: 12px; box-shadow: 0 2px 6px rgba(0,0,0,.05); }}
-    h1 {{ margin-top: 0; }}
-    label {{ display:block; margin: 12px 0 6px; font-weight: 700; font-size: 14px; letter-spacing:.2px; }}
-    select, input[type=text], input[type=password] {{ width: 100%; padding: 10px; border: 1px solid #ccc; border-radius: 8px; font-size:16px; }}
-    .row {{ display: grid; grid-template-columns: 1fr 1fr; gap: 16px; }}
-    .muted {{ color: #666; font-size: 0.95em; }}
-    .warn {{ background: #fff3cd; border: 1px solid #ffeeba; padding: 8px 12px; border-radius: 8px; }}
-    .group-grid {{ display: grid; grid-template-columns: repeat(3, minmax(0, 1fr)); grid-gap: 8px; }}
-    .hosts-box {{ max-height: 260px; overflow-y: auto; padding: 8px; border: 1px solid #eee; border-radius: 8px; background:#fff; }}
-    .toolbar {{ display:flex; gap:8px; margin: 6px 0 10px; }}
-    .tbtn {{ padding:6px 10px; border:1px solid #ccc; border-radius:6px; background:#f8f9fa; cursor:pointer; }}
-    pre {{ background: #0b1020; color: #d1e7ff; padding: 12px; border-radius: 8px; overflow-x: auto; white-space: pre-wrap; }}
-
-    /* Unified buttons */
-    .actions {{ display:flex; gap:16px; margin-top:16px; align-items:center; }}
-    .btn, .btn:link, .btn:visited {{
-      display:inline-flex; align-items:center; justify-content:center;
-      height:48px; padding:0 22px; font-weight:700; font-size:20px; line-height:1;
-      color:#fff; background:#0d6efd; border:0; border-radius:16px; text-decoration:none; cursor:pointer;
-      box-shadow:0 1px 2px rgba(0,0,0,.06), 0 4px 14px rgba(13,110,253,.25);
-      transition:background .15s ease, transform .02s ease; -webkit-appearance:none; appearance:none;
-    }}
-    button.btn {{ border:0; }}
-    .btn:hover {{ background:#0b5ed7; }}
-    .btn:active {{ transform:translateY(1px); }}
-    .btn:focus {{ outline:none; box-shadow:0 0 0 4px rgba(13,110,253,.25); }}
-  </style>
-  <script>
-    function selectAllHosts(val) {{
-      var boxes = document.querySelectorAll('input[name="hosts"]');
-      for (var i=0; i<boxes.length; i++) {{ boxes[i].checked = val; }}
-    }}
-    function toggleInventorySubmit() {{
-      document.getElementById('action').value = 'refresh';
-      document.getElementById('runnerForm').submit();
-    }}
-    function onPlaybookChanged() {{
-      // When playbook changes, refresh to re-filter inventories and suggested/forced user
-      document.getElementById('action').value = 'refresh';
-      document.getElementById('runnerForm').submit();
-    }}
-    function syncRegionToHosts() {{
-      var selected = new Set();
-      var r = document.querySelectorAll('input[name="regions"]:checked');
-      for (var i=0;i<r.length;i++) selected.add(r[i].value);
-      var hosts = document.querySelectorAll('input[name="hosts"]');
-      for (var j=0;j<hosts.length;j++) {{
-        var cb = hosts[j];
-        var groups = (cb.getAttribute('data-groups') || '').split(',');
-        var match = false;
-        for (var k=0;k<groups.length;k++) {{
-          if (selected.has(groups[k])) {{ match = true; break; }}
-        }}
-        if (selected.size > 0) {{
-          cb.checked = match;
-        }}
-      }}
-    }}
-    document.addEventListener('DOMContentLoaded', function() {{
-      var regionCbs = document.querySelectorAll('input[name="regions"]');
-      for (var i=0;i<regionCbs.length;i++) {{
-        regionCbs[i].addEventListener('change', syncRegionToHosts);
-      }}
-      syncRegionToHosts();
-    }});
-  </script>
-</head>
-<body>
+    html_out = _FORM_HEAD + """<body>
   <div class="card">
     <h1>Ansible Playbook CGI Runner</h1>
     {msg_html}
@@ -513,7 +784,7 @@ def render_form(msg: str = "", form: cgi.FieldStorage = None):
     print(html_out)
 
 # ---------------- RUN ----------------
-def run_playbook(form: cgi.FieldStorage):
+def run_playbook(form: Form):
     playbook_key = form.getfirst("playbook", "")
     inventory_key = form.getfirst("inventory_key", "")
     hosts = form.getlist("hosts")
@@ -531,12 +802,12 @@ def run_playbook(form: cgi.FieldStorage):
         render_form("Invalid inventory for selected playbook.", form); return
     if not hosts:
         render_form("No hosts selected.", form); return
-    for h in hosts:
-        if not HOST_RE.match(h):
-            render_form("Invalid hostname: {}".format(h), form); return
-    if not USER_RE.match(user):
+    bad = first_bad_host(hosts)
+    if bad is not None:
+        render_form("Invalid hostname: {}".format(bad), form); return
+    if not is_name(user):
         render_form("Invalid SSH user.", form); return
-    if tags and not TAGS_RE.match(tags):
+    if tags and not is_name_list(tags):
         render_form("Invalid characters in tags.", form); return
 
     playbook_path  = PLAYBOOKS[playbook_key]["path"]
@@ -568,12 +839,21 @@ def run_playbook(form: cgi.FieldStorage):
         cmd.append("-b")
     if tags:
         cmd += ["--tags", tags]
-    if ssh_pass:
-        cmd += ["-e", "ansible_password={}".format(ssh_pass)]
-    if become_pass:
-        cmd += ["-e", "ansible_become_password={}".format(become_pass)]
     if ssh_private_key:
         cmd += ["--private-key", ssh_private_key]
+
+    # Secrets go in a private extra-vars file, not argv (visible in /proc/*/cmdline).
+    secret_vars = {}
+    if ssh_pass:
+        secret_vars["ansible_password"] = ssh_pass
+    if become_pass:
+        secret_vars["ansible_become_password"] = become_pass
+    vars_path = None
+    if secret_vars:
+        fd, vars_path = tempfile.mkstemp(prefix="vars_", suffix=".json", dir=RUN_TMP)  # mode 0600
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(secret_vars, f)
+        cmd += ["-e", "@" + vars_path]
     if USE_SUDO:
         cmd = [SUDO_BIN, "-n", "--"] + cmd
 
@@ -591,38 +871,25 @@ def run_playbook(form: cgi.FieldStorage):
 
     start_ts = time.time()
     try:
-        proc = subprocess.run(
+        proc = subprocess.Popen(
             cmd,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
             env=env,
-            timeout=RUN_TIMEOUT_SECS,
             cwd=Path(playbook_path).parent,
+            bufsize=1,
+            errors="replace",
+            start_new_session=True,  # own process group, so a kill reaches ansible's workers too
             **TEXT_KW
         )
-        output = proc.stdout
-        rc = proc.returncode
-    except subprocess.TimeoutExpired as e:
-        output = (e.output or "") + "\nERROR: Execution timed out after {}s.\n".format(RUN_TIMEOUT_SECS)
-        rc = 124
     except Exception as e:
+        _unlink_quiet(vars_path)
         header_ok(); print("<pre>{}</pre>".format(safe(str(e)))); return
 
-    # Recent reports (last 2 hours or since start)
-    since_ts = max(start_ts - 5, time.time() - 2 * 3600)
-    recent_reports = find_reports(hosts, since_ts)
-
-    # Render result (mask command)
+    # Stream the output as ansible produces it; the result is filled in at the end (mask command)
     header_ok()
-    status = "✅ SUCCESS" if rc == 0 else "❌ FAILED (rc={})".format(rc)
     masked_cmd = "ansible-playbook [redacted]"
-    recent_html = render_reports_list(
-        "Reports (last 2h, matching selected hosts)",
-        recent_reports,
-        "Roots: {}".format(", ".join(REPORT_BASES)),
-    )
-
-    html_out = """<!DOCTYPE html>
+    print("""<!DOCTYPE html>
 <html>
 <head>
   <meta charset="utf-8" />
@@ -646,10 +913,54 @@ def run_playbook(form: cgi.FieldStorage):
 </head>
 <body>
   <div class="card">
-    <h1>{status}</h1>
+    <h1 id="status">⏳ RUNNING…</h1>
     <p><strong>Command:</strong> <code>{cmd}</code></p>
     <h3>Output</h3>
-    <pre>{out}</pre>
+    <pre>""".format(cmd=safe(masked_cmd)), end="")
+    sys.stdout.flush()
+
+    def _kill_group():
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+    expired = threading.Event()
+    def _expire():
+        expired.set()
+        _kill_group()
+    timer = threading.Timer(RUN_TIMEOUT_SECS, _expire)
+    timer.daemon = True
+    timer.start()
+    try:
+        for line in proc.stdout:
+            sys.stdout.write(safe(line))
+            sys.stdout.flush()
+        rc = proc.wait()
+    except BaseException:
+        _kill_group()  # client went away: do not leave ansible blocked on a full pipe
+        raise
+    finally:
+        timer.cancel()
+        proc.stdout.close()
+        _unlink_quiet(vars_path)
+    if expired.is_set():
+        sys.stdout.write("\nERROR: Execution timed out after {}s.\n".format(RUN_TIMEOUT_SECS))
+        rc = 124
+
+    # Recent reports (last 2 hours or since start)
+    since_ts = max(start_ts - 5, time.time() - 2 * 3600)
+    recent_reports = find_reports(hosts, since_ts, fresh=True)  # must see what this run just wrote
+
+    status = "✅ SUCCESS" if rc == 0 else "❌ FAILED (rc={})".format(rc)
+    recent_html = render_reports_list(
+        "Reports (last 2h, matching selected hosts)",
+        recent_reports,
+        "Roots: {}".format(", ".join(REPORT_BASES)),
+    )
+
+    print("""</pre>
+    <p><strong>Result:</strong> {status}</p>
+    <script>document.getElementById('status').textContent = {status_js};</script>
 
     {recent}
     <div class="actions">
@@ -661,17 +972,17 @@ def run_playbook(form: cgi.FieldStorage):
 </html>
 """.format(
         status=safe(status),
-        cmd=safe(masked_cmd),
-        out=safe(output),
+        status_js=json.dumps(status),
         recent=recent_html,
-    )
-    print(html_out)
+    ))
 
 # ---------------- MAIN ----------------
-def main():
+def handle(method, form):
+    """Dispatch one request; handlers write a CGI-style response to stdout."""
+    if form is None:
+        print("Status: 413 Request Entity Too Large")
+        header_ok(); print("<pre>Request too large.</pre>"); return
     try:
-        method = os.environ.get("REQUEST_METHOD", "GET").upper()
-        form = cgi.FieldStorage()
         action = form.getfirst("action", "")
         if method == "GET" and action == "view_report":
             serve_report(form)
@@ -686,5 +997,113 @@ def main():
         import traceback
         print("<pre>{}</pre>".format(safe(traceback.format_exc())))
 
+def main():
+    method = os.environ.get("REQUEST_METHOD", "GET").upper()
+    handle(method, parse_form(os.environ, sys.stdin.buffer))
+
+class _ThreadStdout(object):
+    """sys.stdout stand-in that sends writes to a per-thread capture stream."""
+
+    def __init__(self, default):
+        self._default = default
+        self._local = threading.local()
+
+    def capture(self, stream):
+        self._local.stream = stream
+
+    def __getattr__(self, name):
+        return getattr(getattr(self._local, "stream", None) or self._default, name)
+
+class _QueueSink(io.RawIOBase):
+    """Raw binary stream that hands every write to a queue.Queue.
+
+    Once the client is gone (closed_by_client set), writes raise BrokenPipeError
+    like a CGI stdout would, so run_playbook stops its run.
+    """
+
+    def __init__(self, q):
+        super().__init__()
+        self._q = q
+        self.closed_by_client = threading.Event()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        if self.closed_by_client.is_set():
+            raise BrokenPipeError("client disconnected")
+        self._q.put(bytes(b))
+        return len(b)
+
+def _split_cgi_head(head):
+    status = "200 OK"
+    headers = []
+    for line in head.decode("latin-1").splitlines():
+        name, _, value = line.partition(":")
+        if name.strip().lower() == "status":
+            status = value.strip()
+        elif name.strip():
+            headers.append((name.strip(), value.strip()))
+    if not headers:
+        headers.append(("Content-Type", "text/html; charset=utf-8"))
+    return status, headers
+
+def application(environ, start_response):
+    """WSGI entry point.
+
+    Handlers print CGI output, so each request runs in a worker thread whose
+    stdout feeds a queue; the leading header block is split off into the WSGI
+    status/headers and the body is yielded as it is flushed.
+    """
+    if not isinstance(sys.stdout, _ThreadStdout):
+        sys.stdout = _ThreadStdout(sys.stdout)
+    method = environ.get("REQUEST_METHOD", "GET").upper()
+    form = parse_form(environ, environ["wsgi.input"])
+
+    chunks = queue.Queue()
+    sink = _QueueSink(chunks)
+
+    def work():
+        out = io.TextIOWrapper(io.BufferedWriter(sink, 65536), encoding="utf-8")
+        sys.stdout.capture(out)
+        try:
+            handle(method, form)
+            out.flush()
+        except OSError:
+            pass  # client went away mid-response
+        finally:
+            sys.stdout.capture(None)
+            chunks.put(None)
+
+    threading.Thread(target=work, daemon=True).start()
+
+    raw = b""
+    done = False
+    while b"\n\n" not in raw:
+        chunk = chunks.get()
+        if chunk is None:
+            done = True
+            break
+        raw += chunk
+    head, sep, body = raw.partition(b"\n\n")
+    if not sep:
+        head, body = b"", raw
+    status, headers = _split_cgi_head(head)
+    start_response(status, headers)
+
+    def body_iter(first, done):
+        try:
+            if first:
+                yield first
+            while not done:
+                chunk = chunks.get()
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            sink.closed_by_client.set()
+
+    return body_iter(body, done)
+
 if __name__ == "__main__":
     main()
@@ -3,26 +3,40 @@
 """
 Ansible Playbook CGI Runner — single-file, Python 3.7+ compatible
 - Playbook runner (background job)
-- Watch page (polling logs + recent reports)
+- Watch page (streamed or polled logs + recent reports)
 - Reports browser (list + safe view)
 - Inventory parsing + UI
+
+Runs as a plain CGI script, or as a long-lived WSGI app via `application`
+so module-level caches survive between requests, e.g. with mod_wsgi:
+    WSGIDaemonProcess ansible-runner processes=2 threads=8
+    WSGIScriptAlias /runner /var/www/cgi-bin/runner12.py process-group=ansible-runner
+
+Optionally run `runner12.py --index-reports` as a service (needs inotify_simple)
+to keep the reports index current without scanning REPORT_BASES per request.
 """
 
-import cgi
-import cgitb
-import html
+import io
 import json
 import os
 import re
-import shutil
-import subprocess
+import stat
+import string
 import sys
+import threading
 import time
-from pathlib import Path
-from urllib.parse import quote, unquote
+from collections import defaultdict
+from urllib.parse import parse_qsl, quote, unquote
+
+try:
+    import orjson
+except ImportError:  # optional: stdlib json fallback
+    orjson = None
 
-# Enable CGI exception reporting (to server error logs / browser when developing)
-cgitb.enable()
+try:
+    import inotify_simple
+except ImportError:  # optional: streams fall back to timed polling, no --index-reports
+    inotify_simple = None
 
 # ---------------- CONFIG ----------------
 PLAYBOOKS = {
@@ -52,20 +66,54 @@ REPORT_BASES = [
     "/tmp",
 ]
 
-ANSIBLE_BIN = shutil.which("ansible-playbook") or "/usr/bin/ansible-playbook"
+# REPORT_BASES are fixed at deploy time: resolve each one once, as a "dir/" prefix.
+_REPORT_BASE_REAL = {b: os.path.join(os.path.realpath(b), "") for b in REPORT_BASES}
+
+
+def _find_bin(name: str, default: str) -> str:
+    """The usual install path if it is there (one access() call); a PATH search only if not."""
+    if os.access(default, os.X_OK):
+        return default
+    import shutil
+    return shutil.which(name) or default
+
+
+ANSIBLE_BIN = _find_bin("ansible-playbook", "/usr/bin/ansible-playbook")
 DEFAULT_USER = os.environ.get("ANSIBLE_SSH_USER", "ansadmin")
 RUN_TIMEOUT_SECS = 8 * 3600
+MAX_FORKS = 50  # upper bound on ansible's parallel hosts for one run
+FACT_CACHE_TIMEOUT = 3600  # seconds a host's gathered facts are reused across runs
 
 USE_SUDO = False
-SUDO_BIN = shutil.which("sudo") or "/usr/bin/sudo"
+SUDO_BIN = _find_bin("sudo", "/usr/bin/sudo")
 
 # Directories writable by web user (change as needed)
 RUN_HOME = "/tmp/www-ansible/home"
 RUN_TMP  = "/tmp/www-ansible/tmp"
 JOB_DIR  = "/tmp/www-ansible/jobs"
+# Per-run password files (mode 0700 dir): must stay outside every REPORT_BASES entry.
+SECRETS_DIR = "/dev/shm/www-ansible"
+
+# Never scanned or served as reports, even though /tmp is a report base
+# ("dir/" prefixes, as configured and resolved).
+_PRIVATE_DIRS = tuple({os.path.join(p, "") for d in (RUN_HOME, RUN_TMP, JOB_DIR, SECRETS_DIR)
+                       for p in (os.path.normpath(d), os.path.realpath(d))})
+
+# Shared on-disk index of the reports under REPORT_BASES (see _load_report_index).
+# It lives in RUN_TMP, which the scan skips: writing it must not change the
+# mtime of a directory recorded in it.
+REPORT_INDEX_PATH = RUN_TMP + "/report_index.json"
+REPORT_INDEX_MAX_AGE = 60  # seconds
+
+# Largest urlencoded POST body accepted (a few bytes per selected host)
+MAX_FORM_BYTES = 4 * 1024 * 1024
+
+# Show Python tracebacks in the browser (development only)
+DEBUG = os.environ.get("DEBUG") == "1"
 
 # Validation regexes
 HOST_RE = re.compile(r"^[A-Za-z0-9_.-]+$")
+HOSTS_RE = re.compile(r"^[A-Za-z0-9_.-]+(?:,[A-Za-z0-9_.-]+)*$")  # HOST_RE for a ","-joined list
 USER_RE = re.compile(r"^[A-Za-z0-9_.-]+$")
 TAGS_RE = re.compile(r"^[A-Za-z0-9_,.-]+$")
 
@@ -77,143 +125,420 @@ def header_ok(ct: str = "text/html; charset=utf-8"):
     print()
 
 
+# Same output as html.escape(s, quote=True), as a single C-level translate pass.
+_HTML_TRANS = str.maketrans({
+    "&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#x27;",
+})
+
+
 def safe(s):
-    return html.escape("" if s is None else str(s))
+    return ("" if s is None else str(s)).translate(_HTML_TRANS)
+
+
+class Form(dict):
+    """Minimal stand-in for cgi.FieldStorage: {name: [values]} with getfirst/getlist."""
+
+    def getfirst(self, key, default=None):
+        values = self.get(key)
+        return values[0] if values else default
+
+    def getlist(self, key):
+        return list(self.get(key, ()))
+
+
+def parse_form(environ, stream):
+    """Parse an urlencoded POST body plus QUERY_STRING (no file uploads needed).
+
+    Returns None for a body over MAX_FORM_BYTES: it is refused whole, since a
+    cut-off prefix can end in a shortened value (hosts=web12 -> hosts=web1).
+    """
+    pairs = []
+    if environ.get("REQUEST_METHOD", "GET").upper() == "POST":
+        try:
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            length = 0
+        if length > MAX_FORM_BYTES:
+            return None
+        if length > 0:
+            pairs += parse_qsl(stream.read(length).decode("utf-8", "replace"))
+    pairs += parse_qsl(environ.get("QUERY_STRING", ""))
+    form = Form()
+    for k, v in pairs:
+        form.setdefault(k, []).append(v)
+    return form
+
+
+_DIRS_READY = False
 
 
 def ensure_dirs():
-    Path(RUN_HOME).mkdir(parents=True, exist_ok=True)
-    Path(RUN_TMP).mkdir(parents=True, exist_ok=True)
-    Path(JOB_DIR).mkdir(parents=True, exist_ok=True)
+    global _DIRS_READY
+    if _DIRS_READY:
+        return
+    os.makedirs(RUN_HOME, exist_ok=True)
+    os.makedirs(RUN_TMP, exist_ok=True)
+    os.makedirs(JOB_DIR, exist_ok=True)
+    os.makedirs(SECRETS_DIR, mode=0o700, exist_ok=True)
+    os.chmod(SECRETS_DIR, 0o700)  # fails (and so refuses to run) if someone else created it
+    _DIRS_READY = True
 
 
 def new_job_id():
-    return "%d_%s" % (int(time.time()), os.urandom(6).hex())
+    import secrets
+    return "%d_%s" % (time.time_ns() // 1000000000, secrets.token_hex(6))
 
 
 def job_paths(job_id):
-    jdir = os.path.join(JOB_DIR, job_id)
+    # JOB_DIR is absolute and POSIX-only, so plain string joins are enough.
+    jdir = JOB_DIR + "/" + job_id
     return {
         "dir": jdir,
-        "log": os.path.join(jdir, "output.log"),
-        "meta": os.path.join(jdir, "meta.json"),
-        "rc": os.path.join(jdir, "rc.txt"),
-        "cmd": os.path.join(jdir, "command.txt"),
+        "log": jdir + "/output.log",
+        "meta": jdir + "/meta.json",
+        "rc": jdir + "/rc.txt",
+        "cmd": jdir + "/command.txt",
+        "vars": SECRETS_DIR + "/" + job_id + ".json",
     }
 
 
+def job_start_ts(job_id, jp):
+    """Job start time: encoded in the id by new_job_id(), else read from meta.json."""
+    try:
+        return int(job_id.split("_", 1)[0])
+    except ValueError:
+        return read_json(jp["meta"], {}).get("start_ts", int(time.time()))
+
+
+def json_bytes(data):
+    """Compact UTF-8 JSON: orjson when installed, else json without \\uXXXX escaping."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+_NO_SUCH_JOB = b'{"error":"no-such-job"}'
+
+
 def write_json(path, data):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f)
+    """Write JSON atomically (tmp file + rename) so pollers never see a torn file."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(json_bytes(data))
+    os.replace(tmp, path)
 
 
 def read_json(path, default=None):
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(path, "rb") as f:
+            data = f.read()
+        if orjson is not None:
+            return orjson.loads(data)
+        return json.loads(data.decode("utf-8"))
     except Exception:
         return default
 
 
-def process_running(pid):
-    try:
-        os.kill(pid, 0)
-        return True
-    except Exception:
-        return False
+# ---------------- INVENTORY PARSING ----------------
+# One line of an INI inventory: comment | [section] | host token (up to whitespace or "=").
+# Matched on the raw bytes; "\r" is allowed before "$" so CRLF files still parse.
+_INV_LINE_RE = re.compile(rb"^[ \t]*(?:[#;]|\[(.*)\][ \t\r]*$|([^\s=]+))", re.M)
+
+
+def _sorted_ci(names):
+    """Case-insensitive sort: casefold each name once, then sort plain tuples."""
+    decorated = [(n.casefold(), n) for n in names]
+    decorated.sort()
+    return [n for _, n in decorated]
 
 
-# ---------------- INVENTORY PARSING ----------------
 def parse_ini_inventory_groups(path):
     """Parse simple INI inventory into {group: [hosts]} (best-effort)."""
     groups = {}
     current = None
     if not os.path.exists(path):
         return {}
-    with open(path, "r", encoding="utf-8", errors="replace") as f:
-        for raw in f:
-            line = raw.strip()
-            if not line or line.startswith("#") or line.startswith(";"):
-                continue
-            if line.startswith("[") and line.endswith("]"):
-                current = line[1:-1].strip()
-                groups.setdefault(current, [])
-                continue
-            if current:
-                token = line.split()[0].split("=")[0].strip()
-                if token:
-                    if token not in groups[current]:
-                        groups[current].append(token)
+    with open(path, "rb") as f:
+        data = f.read()
+    # Only section names and host tokens are decoded; comments and blank lines never become str.
+    for section, token in _INV_LINE_RE.findall(data):
+        if section:
+            current = sys.intern(section.decode("utf-8", "replace").strip())
+            groups.setdefault(current, set())
+        elif token and current:
+            groups[current].add(sys.intern(token.decode("utf-8", "replace")))
     for k in ("all", "ungrouped"):
         if k in groups and not groups[k]:
             groups.pop(k, None)
-    for k in groups:
-        groups[k] = sorted(groups[k], key=str.lower)
-    return dict(sorted(groups.items(), key=lambda kv: kv[0].lower()))
+    return {k: _sorted_ci(groups[k]) for k in _sorted_ci(groups)}
+
+
+# path -> ((st_mtime_ns, st_size, st_ino), (groups_map, all_hosts, host_groups, host_rows, group_rows))
+_INV_CACHE = {}
+_INV_CACHE_LOCK = threading.Lock()
 
 
 def get_inventory_maps(inv_key):
+    """Return (groups_map, all_hosts, host_groups, host_rows, group_rows).
+
+    host_rows is [(host, host_html, groups_csv_html)] in all_hosts order and
+    group_rows is [(group, group_html, n_hosts)]: the form's checkbox data,
+    HTML-escaped once here rather than on every render.
+    Cached per inventory path until the file's mtime, size or inode change
+    (an inventory replaced by rename gets a new inode even with equal mtime).
+    """
     meta = INVENTORIES.get(inv_key or "", {})
     path = meta.get("path", "")
     if not path:
-        return {}, [], {}
+        return {}, [], {}, [], []
+    try:
+        st = os.stat(path)
+    except OSError:
+        with _INV_CACHE_LOCK:
+            _INV_CACHE.pop(path, None)
+        return {}, [], {}, [], []
+    sig = (st.st_mtime_ns, st.st_size, st.st_ino)
+    cached = _INV_CACHE.get(path)
+    if cached and cached[0] == sig:
+        return cached[1]
     groups_map = parse_ini_inventory_groups(path)
-    host_groups = {}
+    inverted = defaultdict(list)
     for g, hosts in groups_map.items():
         for h in hosts:
-            host_groups.setdefault(h, []).append(g)
-    all_hosts = sorted(host_groups.keys(), key=str.lower)
-    return groups_map, all_hosts, host_groups
+            inverted[h].append(g)
+    host_groups = dict(inverted)
+    all_hosts = _sorted_ci(host_groups)
+    esc = _HTML_TRANS
+    host_rows = [(h, h.translate(esc), ",".join(host_groups[h]).translate(esc)) for h in all_hosts]
+    group_rows = [(g, g.translate(esc), len(hosts)) for g, hosts in groups_map.items()]
+    result = (groups_map, all_hosts, host_groups, host_rows, group_rows)
+    with _INV_CACHE_LOCK:
+        _INV_CACHE[path] = (sig, result)
+    return result
 
 
 # ---------------- REPORT HELPERS ----------------
-def _is_safe_relpath(rel):
-    # disallow traversal tokens or absolute paths
-    if not rel or rel.startswith("/") or ".." in rel:
+def _report_entry(base, path, name, st):
+    return {
+        "file": name,
+        "path": path,
+        "mtime": int(st.st_mtime),
+        "base": base,
+        "rel": os.path.relpath(path, base),
+    }
+
+
+def _scan(base, top, since_ts, host_filter, dirs=None):
+    """Yield matching .html reports under `top` (os.scandir, depth-first).
+
+    Type and name come from the directory read itself; only files that pass
+    the name checks cost a stat(). Directory symlinks are listed but not
+    followed, as with os.walk. If `dirs` is a dict, each directory's mtime_ns
+    is recorded in it (taken before listing, so a change made mid-scan still
+    shows up as a newer mtime later). The runner's own _PRIVATE_DIRS are skipped.
+    """
+    try:
+        if dirs is not None:
+            dirs[top] = os.stat(top).st_mtime_ns
+        it = os.scandir(top)
+    except OSError:
+        return
+    subdirs = []
+    with it:
+        for entry in it:
+            try:
+                if entry.is_dir():
+                    if not entry.is_symlink() and entry.path + "/" not in _PRIVATE_DIRS:
+                        subdirs.append(entry.path)
+                    continue
+                name = entry.name
+                lname = name.lower()
+                if not lname.endswith(".html"):
+                    continue
+                if host_filter and host_filter not in lname:
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue
+            if since_ts and st.st_mtime < since_ts:
+                continue
+            yield _report_entry(base, entry.path, name, st)
+    # the scandir handle is closed before descending: one open fd at a time
+    for path in subdirs:
+        yield from _scan(base, path, since_ts, host_filter, dirs)
+
+
+def _index_is_current(idx):
+    if not isinstance(idx, dict) or idx.get("bases") != REPORT_BASES:
         return False
-    if "\\" in rel:
+    if not 0 <= time.time() - idx.get("built", 0) < REPORT_INDEX_MAX_AGE:
         return False
+    if idx.get("watched"):
+        return True  # kept current by index_reports_forever(), which also refreshes "built"
+    # A new, removed or renamed entry anywhere changes its directory's mtime.
+    for d, mtime_ns in idx.get("dirs", {}).items():
+        try:
+            if os.stat(d).st_mtime_ns != mtime_ns:
+                return False
+        except OSError:
+            return False
     return True
 
 
-def find_reports(since_ts=None, host_filter=""):
-    """Scan REPORT_BASES for .html reports. Return list of dicts."""
-    results = []
+def _load_report_index():
+    """Every .html report under REPORT_BASES, newest first, via REPORT_INDEX_PATH.
+
+    The index is shared by all CGI processes. It is reused while every
+    directory recorded in it keeps its mtime (one stat() per directory instead
+    of listing them and stat()ing every file) and for at most
+    REPORT_INDEX_MAX_AGE seconds, which bounds how long a report rewritten in
+    place (no directory change) can show a stale time.
+    """
+    idx = read_json(REPORT_INDEX_PATH)
+    if _index_is_current(idx):
+        return idx["entries"]
+    built = time.time()
+    dirs = {}
+    entries = []
     for base in REPORT_BASES:
-        if not os.path.isdir(base):
-            continue
-        for root, dirs, files in os.walk(base):
-            for f in files:
-                if not f.lower().endswith(".html"):
+        entries.extend(_scan(base, base, None, "", dirs))
+    entries.sort(key=lambda r: r["mtime"], reverse=True)
+    _save_report_index({"bases": REPORT_BASES, "built": built, "dirs": dirs, "entries": entries})
+    return entries
+
+
+def _save_report_index(idx):
+    # Unique tmp name: concurrent rebuilds must not write into the same file.
+    tmp = "%s.%d.tmp" % (REPORT_INDEX_PATH, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(REPORT_INDEX_PATH), exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(json_bytes(idx))
+        os.replace(tmp, REPORT_INDEX_PATH)
+    except OSError:
+        pass  # index is an optimisation only
+
+
+def index_reports_forever():
+    """Keep REPORT_INDEX_PATH current from inotify events (`runner12.py --index-reports`).
+
+    Meant to run as a service next to the CGI. Every directory under
+    REPORT_BASES is watched; an event updates only the report or subtree it
+    names, so requests never list or stat anything. The index is marked
+    "watched" and rewritten at least every REPORT_INDEX_MAX_AGE / 3 seconds;
+    if this process stops, it goes stale and requests fall back to
+    _load_report_index()'s own scan.
+    """
+    if inotify_simple is None:
+        sys.exit("--index-reports needs the inotify_simple package")
+    os.makedirs(os.path.dirname(REPORT_INDEX_PATH), exist_ok=True)
+    f = inotify_simple.flags
+    mask = f.CREATE | f.DELETE | f.MOVED_FROM | f.MOVED_TO | f.CLOSE_WRITE | f.ATTRIB
+    heartbeat = REPORT_INDEX_MAX_AGE / 3
+    ino = inotify_simple.INotify()
+    watches = {}  # wd -> (base, dir)
+    entries = {}  # path -> report entry
+
+    def add_tree(base, top):
+        # Watches go on after a directory is listed, so list the tree again once
+        # they are in place: whatever appeared in between shows up in pass two.
+        for _ in range(2):
+            dirs = {}
+            for r in _scan(base, top, None, "", dirs):
+                entries[r["path"]] = r
+            for d in dirs:
+                try:
+                    watches[ino.add_watch(d, mask)] = (base, d)  # same wd again on re-add
+                except OSError:
+                    pass  # vanished already, or out of watches
+
+    def drop_tree(top):
+        prefix = top + os.sep
+        for path in [p for p in entries if p.startswith(prefix)]:
+            del entries[path]
+        for wd, (_, d) in list(watches.items()):
+            if d == top or d.startswith(prefix):
+                del watches[wd]
+                try:
+                    ino.rm_watch(wd)
+                except OSError:
+                    pass
+
+    def rebuild():
+        for wd in list(watches):
+            try:
+                ino.rm_watch(wd)
+            except OSError:
+                pass
+        watches.clear()
+        entries.clear()
+        for base in REPORT_BASES:
+            add_tree(base, base)
+
+    rebuild()
+    changed, written = True, 0.0
+    while True:
+        if changed or time.time() - written >= heartbeat:
+            # A base that did not exist at startup is picked up on the next beat.
+            watched = {d for _, d in watches.values()}
+            for base in REPORT_BASES:
+                if base not in watched and os.path.isdir(base):
+                    add_tree(base, base)
+            written = time.time()
+            _save_report_index({
+                "bases": REPORT_BASES, "built": written, "watched": True, "dirs": {},
+                "entries": sorted(entries.values(), key=lambda r: r["mtime"], reverse=True),
+            })
+            changed = False
+        # read_delay batches a burst of events (a playbook writing many reports) into one write.
+        for ev in ino.read(timeout=int(heartbeat * 1000), read_delay=200):
+            if ev.mask & f.Q_OVERFLOW:
+                rebuild()
+                changed = True
+                break
+            if ev.mask & f.IGNORED:
+                watches.pop(ev.wd, None)
+                continue
+            if ev.wd not in watches or not ev.name:
+                continue
+            base, d = watches[ev.wd]
+            path = os.path.join(d, ev.name)
+            if ev.mask & f.ISDIR:
+                if ev.mask & (f.DELETE | f.MOVED_FROM):
+                    drop_tree(path)
+                elif ev.mask & (f.CREATE | f.MOVED_TO):
+                    if path + "/" in _PRIVATE_DIRS:
+                        continue  # e.g. JOB_DIR made by the first run after startup
+                    add_tree(base, path)
+                else:
+                    continue
+            elif not ev.name.lower().endswith(".html"):
+                continue  # /tmp churn that is not a report
+            elif ev.mask & (f.DELETE | f.MOVED_FROM):
+                if entries.pop(path, None) is None:
                     continue
-                path = os.path.join(root, f)
+            else:
                 try:
                     st = os.stat(path)
-                except Exception:
+                except OSError:
                     continue
-                if since_ts and st.st_mtime < since_ts:
+                if stat.S_ISDIR(st.st_mode):
                     continue
-                if host_filter and host_filter.lower() not in f.lower():
-                    continue
-                rel = os.path.relpath(path, base)
-                results.append({
-                    "file": f,
-                    "path": path,
-                    "mtime": int(st.st_mtime),
-                    "base": base,
-                    "rel": rel,
-                })
-    results.sort(key=lambda r: r["mtime"], reverse=True)
-    return results
+                entries[path] = _report_entry(base, path, ev.name, st)
+            changed = True
 
 
-def render_list_reports(form):
-    header_ok()
-    host_filter = (form.getfirst("host") or "").strip()
-    since = int(time.time()) - 24 * 3600
-    reports = find_reports(since_ts=since, host_filter=host_filter)
+def find_reports(since_ts=None, host_filter=""):
+    """Return .html reports under REPORT_BASES as a list of dicts, newest first."""
+    host_filter = host_filter.lower()
+    return [r for r in _load_report_index()
+            if not (since_ts and r["mtime"] < since_ts)
+            and (not host_filter or host_filter in r["file"].lower())]
 
-    print("""<!DOCTYPE html>
+
+# $-placeholders: the CSS braces need no {{ }} doubling (a str.format of this
+# page raised KeyError on the first "{" of the stylesheet).
+_REPORTS_PAGE_HEAD = string.Template("""<!DOCTYPE html>
 <html><head><meta charset="utf-8" />
 <title>Reports</title>
 <style>
@@ -227,21 +552,40 @@ def render_list_reports(form):
 <h1>Reports (last 24h)</h1>
 <form method="get">
   <input type="hidden" name="action" value="list_reports"/>
-  <input type="text" name="host" placeholder="Filter by host substring" value="{filt}"/>
+  <input type="text" name="host" placeholder="Filter by host substring" value="$filt"/>
   <button type="submit">Filter</button>
 </form>
 <table>
 <tr><th>Report</th><th>Modified</th><th>Location</th><th>Action</th></tr>
-""".format(filt=safe(host_filter)))
 
+""")
+_REPORTS_NONE = b"<tr><td colspan=4><em>No reports found.</em></td></tr>\n"
+_REPORTS_PAGE_TAIL = b"</table></body></html>\n"
+
+
+def render_list_reports(form):
+    header_ok()
+    host_filter = (form.getfirst("host") or "").strip()
+    since = int(time.time()) - 24 * 3600
+    reports = find_reports(since_ts=since, host_filter=host_filter)
+
+    # Build the whole page as bytes and hand it to the binary layer in one write.
+    parts = [_REPORTS_PAGE_HEAD.substitute(filt=safe(host_filter)).encode("utf-8")]
     if not reports:
-        print("<tr><td colspan=4><em>No reports found.</em></td></tr>")
+        parts.append(_REPORTS_NONE)
+    bases = {}  # base -> (escaped, quoted): a handful of bases, many reports each
     for r in reports:
+        base = r["base"]
+        if base not in bases:
+            bases[base] = (safe(base), quote(base))
+        base_html, base_q = bases[base]
         ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(r["mtime"]))
-        link = "?action=view_report&base={}&rel={}".format(quote(r["base"]), quote(r["rel"]))
-        print("<tr><td>{}</td><td>{}</td><td>{}</td><td><a href='{}' target='_blank'>View</a></td></tr>".format(
-            safe(r["file"]), ts, safe(r["base"]), link))
-    print("</table></body></html>")
+        parts.append(f"<tr><td>{safe(r['file'])}</td><td>{ts}</td><td>{base_html}</td>"
+                     f"<td><a href='?action=view_report&base={base_q}&rel={quote(r['rel'])}' target='_blank'>View</a>"
+                     f"</td></tr>\n".encode("utf-8"))
+    parts.append(_REPORTS_PAGE_TAIL)
+    sys.stdout.flush()
+    sys.stdout.buffer.write(b"".join(parts))
 
 
 def render_view_report(form):
@@ -256,146 +600,228 @@ def render_view_report(form):
     if base not in REPORT_BASES:
         header_ok(); print("<pre>Invalid report base</pre>"); return
 
-    if not _is_safe_relpath(rel):
+    if not rel:
         header_ok(); print("<pre>Invalid report path</pre>"); return
 
-    full = os.path.join(base, rel)
+    # One canonical check: realpath resolves "..", symlinks and an absolute rel,
+    # so the result must still lie under the (pre-resolved) base prefix, be an
+    # .html file and not be one of the runner's own job or work files.
+    base_real = _REPORT_BASE_REAL[base]
     try:
-        base_real = os.path.realpath(base)
-        full_real = os.path.realpath(full)
-        if not (full_real == base_real or full_real.startswith(base_real + os.sep)):
+        full = os.path.realpath(os.path.join(base_real, rel))
+        if (not full.startswith(base_real) or full.startswith(_PRIVATE_DIRS)
+                or not full.lower().endswith(".html")):
             header_ok(); print("<pre>Access denied</pre>"); return
     except Exception:
         header_ok(); print("<pre>Access validation error</pre>"); return
 
-    if not os.path.isfile(full):
+    # Open first: a missing file or a directory is reported without a separate stat.
+    try:
+        f = open(full, "rb")
+    except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
         header_ok(); print("<pre>Report not found</pre>"); return
-
-    header_ok("text/html; charset=utf-8")
+    except OSError as e:
+        header_ok(); print("<pre>Failed to read report: %s</pre>" % safe(str(e))); return
+
+    # The report's bytes are passed through as-is, never decoded.
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        print("Content-Type: text/html; charset=utf-8")
+        print("Content-Length: %d" % size)
+        print()
+        sys.stdout.flush()
+        _send_file(f, size)
+
+
+def _send_file(src, size):
+    """Copy `size` bytes of src to stdout: os.sendfile when stdout is a real fd
+    (CGI), else 256 KiB reads (WSGI)."""
+    out = sys.stdout.buffer
+    sent = 0
     try:
-        with open(full, "r", encoding="utf-8", errors="replace") as f:
-            sys.stdout.write(f.read())
-    except Exception as e:
-        header_ok(); print("<pre>Failed to read report: %s</pre>" % safe(str(e)))
+        out_fd = out.fileno()
+    except (AttributeError, OSError):
+        out_fd = None
+    if out_fd is not None:
+        try:
+            while sent < size:
+                n = os.sendfile(out_fd, src.fileno(), sent, size - sent)
+                if n == 0:
+                    break
+                sent += n
+            return
+        except OSError:
+            if sent:
+                raise  # part of the body is already out; cannot switch methods now
+    src.seek(sent)
+    while sent < size:
+        block = src.read(min(262144, size - sent))
+        if not block:
+            break
+        out.write(block)
+        sent += len(block)
 
 
 # ---------------- RENDER FORM ----------------
-def render_form(msg="", form=None):
-    header_ok()
-    if form is None:
-        form = cgi.FieldStorage()
-
-    selected_playbook = form.getfirst("playbook", "")
-    inventory_key = form.getfirst("inventory_key", "")
-    selected_regions = form.getlist("regions")
-    posted_hosts = form.getlist("hosts")
-
-    if selected_playbook in PLAYBOOKS:
-        allowed_invs = PLAYBOOKS[selected_playbook]["inventories"]
-    else:
-        allowed_invs = []
-
-    groups_map, all_hosts, host_groups = get_inventory_maps(inventory_key)
-
-    playbook_opts = "\n".join(
-        '<option value="{k}" {sel}>{lbl}</option>'.format(
-            k=safe(k), lbl=safe(v["label"]), sel=("selected" if k == selected_playbook else "")
-        )
-        for k, v in PLAYBOOKS.items()
-    )
-    inv_opts = "\n".join(
-        '<option value="{k}" {sel}>{lbl}</option>'.format(
-            k=safe(k), lbl=safe(INVENTORIES[k]["label"]), sel=("selected" if k == inventory_key else "")
-        )
-        for k in allowed_invs if k in INVENTORIES
-    )
-
-    if groups_map:
-        regions_html = "\n".join(
-            '<label><input type="checkbox" name="regions" value="{g}" {chk}/> {g} ({n})</label>'.format(
-                g=safe(group), n=len(groups_map[group]), chk=("checked" if group in selected_regions else "")
-            )
-            for group in groups_map
-        )
-    else:
-        regions_html = "<p class='muted'>No regions to show. Select an inventory first.</p>"
-
-    if all_hosts:
-        hosts_html = "\n".join(
-            '<label><input type="checkbox" name="hosts" value="{h}" data-groups="{gs}" {chk}/> {h}</label>'.format(
-                h=safe(h),
-                gs=safe(",".join(host_groups.get(h, []))),
-                chk=("checked" if posted_hosts and h in posted_hosts else "")
-            )
-            for h in all_hosts
-        )
-    else:
-        hosts_html = "<p class='muted'>No hosts to show.</p>"
-
-    if selected_playbook and "suggest_ssh_user" in PLAYBOOKS[selected_playbook]:
-        user_val = safe(PLAYBOOKS[selected_playbook]["suggest_ssh_user"])
-    elif selected_playbook and "force_ssh_user" in PLAYBOOKS[selected_playbook]:
-        user_val = safe(PLAYBOOKS[selected_playbook]["force_ssh_user"])
-    else:
-        user_val = safe(DEFAULT_USER)
-
-    tags_val = safe(form.getfirst("tags", ""))
-    check_val = "checked" if form.getfirst("check") else ""
-    become_val = "checked" if (form.getfirst("become") or not form) else ""
-    msg_html = ("<div class='warn'>{}</div>".format(safe(msg))) if msg else ""
-
-    print("""<!DOCTYPE html>
+# Static page chrome (no per-request data), encoded once and written verbatim.
+_FORM_HEAD = """<!DOCTYPE html>
 <html>
 <head><meta charset="utf-8" />
 <title>Ansible Playbook CGI Runner</title>
 <style>
-  body {{ font-family: system-ui, -apple-system, Segoe UI, Roboto, Arial, sans-serif; margin: 24px; }}
-  .card {{ max-width: 900px; margin: auto; padding: 20px; border: 1px solid #ddd; border-radius: 12px; box-shadow: 0 2px 6px rgba(0,0,0,.05); }}
-  label {{ display:block; margin: 12px 0 6px; font-weight: 600; }}
-  select, input[type=text], input[type=password] {{ width: 100%; padding: 10px; border: 1px solid #ccc; border-radius: 8px; }}
-  .row {{ display: grid; grid-template-columns: 1fr 1fr; gap: 16px; }}
-  .hosts-box {{ max-height: 260px; overflow-y: auto; padding: 8px; border: 1px solid #eee; border-radius: 8px; background:#fff; }}
-  .group-grid {{ display: grid; grid-template-columns: repeat(3, minmax(0, 1fr)); grid-gap: 8px; }}
-  .actions {{ display:flex; gap:16px; margin-top:16px; align-items:center; }}
-  .btn {{ display:inline-flex; align-items:center; justify-content:center; height:44px; padding:0 18px; font-weight:600; font-size:16px; color:#fff; background:#0d6efd; border:0; border-radius:10px; text-decoration:none; cursor:pointer; }}
+  body { font-family: system-ui, -apple-system, Segoe UI, Roboto, Arial, sans-serif; margin: 24px; }
+  .card { max-width: 900px; margin: auto; padding: 20px; border: 1px solid #ddd; border-radius: 12px; box-shadow: 0 2px 6px rgba(0,0,0,.05); }
+  label { display:block; margin: 12px 0 6px; font-weight: 600; }
+  select, input[type=text], input[type=password] { width: 100%; padding: 10px; border: 1px solid #ccc; border-radius: 8px; }
+  .row { display: grid; grid-template-columns: 1fr 1fr; gap: 16px; }
+  .hosts-box { max-height: 260px; overflow-y: auto; padding: 8px; border: 1px solid #eee; border-radius: 8px; background:#fff; }
+  .group-grid { display: grid; grid-template-columns: repeat(3, minmax(0, 1fr)); grid-gap: 8px; }
+  .actions { display:flex; gap:16px; margin-top:16px; align-items:center; }
+  .btn { display:inline-flex; align-items:center; justify-content:center; height:44px; padding:0 18px; font-weight:600; font-size:16px; color:#fff; background:#0d6efd; border:0; border-radius:10px; text-decoration:none; cursor:pointer; }
 </style>
 <script>
-function selectAllHosts(val) {{
+function selectAllHosts(val) {
   var boxes = document.querySelectorAll('input[name="hosts"]');
   for (var i=0;i<boxes.length;i++) boxes[i].checked = val;
-}}
-function toggleInventorySubmit() {{
+}
+function toggleInventorySubmit() {
   document.getElementById('action').value = 'refresh';
   document.getElementById('runnerForm').submit();
-}}
-function onPlaybookChanged() {{
+}
+function onPlaybookChanged() {
   document.getElementById('action').value = 'refresh';
   document.getElementById('runnerForm').submit();
-}}
-function syncRegionToHosts() {{
+}
+function syncRegionToHosts() {
   var selected = new Set();
   var r = document.querySelectorAll('input[name="regions"]:checked');
   for (var i=0;i<r.length;i++) selected.add(r[i].value);
   var hosts = document.querySelectorAll('input[name="hosts"]');
-  for (var j=0;j<hosts.length;j++) {{
+  for (var j=0;j<hosts.length;j++) {
     var cb = hosts[j];
     var groups = (cb.getAttribute('data-groups') || '').split(',');
     var match = false;
-    for (var k=0;k<groups.length;k++) if (selected.has(groups[k])) {{ match = true; break; }}
+    for (var k=0;k<groups.length;k++) if (selected.has(groups[k])) { match = true; break; }
     if (selected.size > 0) cb.checked = match;
-  }}
-}}
-document.addEventListener('DOMContentLoaded', function() {{
+  }
+}
+document.addEventListener('DOMContentLoaded', function() {
   var regionCbs = document.querySelectorAll('input[name="regions"]');
   for (var i=0;i<regionCbs.length;i++) regionCbs[i].addEventListener('change', syncRegionToHosts);
   syncRegionToHosts();
-}});
+});
 </script>
 </head>
 <body>
   <div class="card">
     <h1>Ansible Playbook CGI Runner</h1>
-    {msg_html}
+""".encode("utf-8")
+_FORM_NO_HOSTS = b"<p class='muted'>No hosts to show.</p>"
+_FORM_TAIL = """      <label for="password">SSH password (optional)</label>
+      <input id="password" name="password" type="password" />
+      <label for="become_pass">Become password (optional)</label>
+      <input id="become_pass" name="become_pass" type="password" />
+      <div class="actions">
+        <button class="btn" type="submit" onclick="document.getElementById('action').value='start'">Run Playbook</button>
+        <a class="btn" href="?action=list_reports" style="background:#198754; text-decoration:none;">Browse reports</a>
+      </div>
+    </form>
+  </div>
+</body>
+</html>
+""".encode("utf-8")
+
+
+# Config keys and labels are fixed at deploy time: escape them once at import.
+_PLAYBOOK_CHOICES = [(k, k.translate(_HTML_TRANS), v["label"].translate(_HTML_TRANS)) for k, v in PLAYBOOKS.items()]
+_INVENTORY_CHOICES = {k: (k.translate(_HTML_TRANS), v["label"].translate(_HTML_TRANS)) for k, v in INVENTORIES.items()}
+
+
+def _iter_host_rows(host_rows, posted_hosts, chunk=500):
+    """Yield the hosts checkbox rows in newline-joined chunks of `chunk` rows."""
+    rows = []
+    append = rows.append
+    sep = ""
+    for h, sh, gs in host_rows:
+        chk = "checked" if h in posted_hosts else ""
+        append(f'<label><input type="checkbox" name="hosts" value="{sh}" data-groups="{gs}" {chk}/> {sh}</label>')
+        if len(rows) >= chunk:
+            yield sep + "\n".join(rows)
+            rows = []
+            sep = "\n"
+    if rows:
+        yield sep + "\n".join(rows)
+
+
+def render_form(msg="", form=None):
+    header_ok()
+    if form is None:
+        form = Form()
+
+    selected_playbook = form.getfirst("playbook", "")
+    inventory_key = form.getfirst("inventory_key", "")
+    selected_regions = set(form.getlist("regions"))
+    posted_hosts = set(form.getlist("hosts"))
+
+    if selected_playbook in PLAYBOOKS:
+        allowed_invs = PLAYBOOKS[selected_playbook]["inventories"]
+    else:
+        allowed_invs = []
+
+    # Only parse the inventory when one valid for this playbook is selected
+    # (the landing page and playbook-only refreshes need no host list).
+    if inventory_key and inventory_key in allowed_invs:
+        _, _, _, host_rows, group_rows = get_inventory_maps(inventory_key)
+    else:
+        host_rows, group_rows = [], []
+
+    buf = []
+    append = buf.append
+    for k, k_html, lbl_html in _PLAYBOOK_CHOICES:
+        sel = "selected" if k == selected_playbook else ""
+        append(f'<option value="{k_html}" {sel}>{lbl_html}</option>')
+    playbook_opts = "\n".join(buf)
+
+    buf = []
+    append = buf.append
+    for k in allowed_invs:
+        if k in _INVENTORY_CHOICES:
+            k_html, lbl_html = _INVENTORY_CHOICES[k]
+            sel = "selected" if k == inventory_key else ""
+            append(f'<option value="{k_html}" {sel}>{lbl_html}</option>')
+    inv_opts = "\n".join(buf)
+
+    if group_rows:
+        buf = []
+        append = buf.append
+        for group, g, n in group_rows:
+            chk = "checked" if group in selected_regions else ""
+            append(f'<label><input type="checkbox" name="regions" value="{g}" {chk}/> {g} ({n})</label>')
+        regions_html = "\n".join(buf)
+    else:
+        regions_html = "<p class='muted'>No regions to show. Select an inventory first.</p>"
+
+    if selected_playbook and "suggest_ssh_user" in PLAYBOOKS[selected_playbook]:
+        user_val = safe(PLAYBOOKS[selected_playbook]["suggest_ssh_user"])
+    elif selected_playbook and "force_ssh_user" in PLAYBOOKS[selected_playbook]:
+        user_val = safe(PLAYBOOKS[selected_playbook]["force_ssh_user"])
+    else:
+        user_val = safe(DEFAULT_USER)
+
+    tags_val = safe(form.getfirst("tags", ""))
+    check_val = "checked" if form.getfirst("check") else ""
+    become_val = "checked" if (form.getfirst("become") or not form) else ""
+    msg_html = ("<div class='warn'>{}</div>".format(safe(msg))) if msg else ""
+
+    # Write the page in sections so the browser can start on <head> while
+    # the (possibly large) host list is still being generated.
+    # Bytes go straight to the binary layer; flush the printed headers first.
+    sys.stdout.flush()
+    out = sys.stdout.buffer
+    out.write(_FORM_HEAD)
+    out.flush()
+    sel_pb = "selected" if not selected_playbook else ""
+    out.write(f"""    {msg_html}
     <form id="runnerForm" method="post" action="">
       <input type="hidden" name="action" id="action" value="refresh" />
       <label for="playbook">Playbook</label>
@@ -416,7 +842,14 @@ document.addEventListener('DOMContentLoaded', function() {{
         <button type="button" onclick="selectAllHosts(false)">Select none</button>
       </div>
       <label>Hosts (from selected inventory):</label>
-      <div class="hosts-box">{hosts_html}</div>
+      <div class="hosts-box">""".encode("utf-8"))
+    if host_rows:
+        for part in _iter_host_rows(host_rows, posted_hosts):
+            out.write(part.encode("utf-8"))
+            out.flush()
+    else:
+        out.write(_FORM_NO_HOSTS)
+    out.write(f"""</div>
       <div class="row">
         <div>
           <label for="user">SSH user (-u)</label>
@@ -429,33 +862,34 @@ document.addEventListener('DOMContentLoaded', function() {{
       </div>
       <label><input type="checkbox" name="check" value="1" {check_val}/> Dry run (--check)</label>
       <label><input type="checkbox" name="become" value="1" {become_val}/> Become (-b)</label>
-      <label for="password">SSH password (optional)</label>
-      <input id="password" name="password" type="password" />
-      <label for="become_pass">Become password (optional)</label>
-      <input id="become_pass" name="become_pass" type="password" />
-      <div class="actions">
-        <button class="btn" type="submit" onclick="document.getElementById('action').value='start'">Run Playbook</button>
-        <a class="btn" href="?action=list_reports" style="background:#198754; text-decoration:none;">Browse reports</a>
-      </div>
-    </form>
-  </div>
-</body>
-</html>
-""".format(
-        msg_html=msg_html,
-        sel_pb=("selected" if not selected_playbook else ""),
-        playbook_opts=playbook_opts,
-        inv_opts=inv_opts,
-        regions_html=regions_html,
-        hosts_html=hosts_html,
-        user_val=user_val,
-        tags_val=tags_val,
-        check_val=check_val,
-        become_val=become_val,
-    ))
+""".encode("utf-8"))
+    out.write(_FORM_TAIL)
+    out.flush()
 
 
 # ---------------- START JOB (background) ----------------
+# Run by /bin/sh as the playbook's parent, so $? is its real exit status. The
+# secrets file ($2, may be empty) is removed once it has exited, then the status
+# goes to rc.txt ($1) via tmp file + rename, so pollers never see it partial.
+_RUN_WRAPPER = ('rc_file=$1 vars_file=$2; shift 2; "$@"; rc=$?; [ -z "$vars_file" ] || rm -f "$vars_file"; '
+                'echo $rc > "$rc_file.tmp" && mv -f "$rc_file.tmp" "$rc_file"')
+
+
+def spawn_job(cmd, env, cwd, log_fd, rc_path, vars_path=""):
+    """Start cmd under the _RUN_WRAPPER shell in a new session; return the shell's pid.
+
+    Popen's fork+exec happens in C, so this is safe from a threaded WSGI
+    daemon, unlike forking the interpreter itself. The shell outlives a CGI
+    request; in a long-lived process a daemon thread reaps it.
+    """
+    import subprocess
+    proc = subprocess.Popen(["/bin/sh", "-c", _RUN_WRAPPER, "ansible-run", rc_path, vars_path] + cmd,
+                            stdin=subprocess.DEVNULL, stdout=log_fd, stderr=subprocess.STDOUT,
+                            env=env, cwd=cwd, start_new_session=True)
+    threading.Thread(target=proc.wait, daemon=True).start()
+    return proc.pid
+
+
 def start_job(form):
     playbook_key = form.getfirst("playbook", "")
     inventory_key = form.getfirst("inventory_key", "")
@@ -474,9 +908,17 @@ def start_job(form):
         render_form("Invalid inventory for selected playbook.", form); return
     if not hosts:
         render_form("No hosts selected.", form); return
-    for h in hosts:
-        if not HOST_RE.match(h):
-            render_form("Invalid hostname: %s" % h, form); return
+    limit = ",".join(hosts)
+    # The comma count catches a single value that itself contains commas.
+    if not HOSTS_RE.match(limit) or limit.count(",") != len(hosts) - 1:
+        # One match for the whole selection; find the culprit only on failure.
+        bad = next((h for h in hosts if not HOST_RE.match(h)), "")
+        render_form("Invalid hostname: %s" % bad, form); return
+    # Only hosts the chosen inventory actually defines (host_groups is cached).
+    _, _, host_groups, _, _ = get_inventory_maps(inventory_key)
+    unknown = [h for h in hosts if h not in host_groups]
+    if unknown:
+        render_form("Unknown hosts for this inventory: %s" % ", ".join(unknown[:5]), form); return
     if not USER_RE.match(user):
         render_form("Invalid SSH user.", form); return
     if tags and not TAGS_RE.match(tags):
@@ -490,10 +932,10 @@ def start_job(form):
 
     ensure_dirs()
     local_tmp = os.path.join(RUN_TMP, "ansible-local")
-    Path(local_tmp).mkdir(parents=True, exist_ok=True)
+    os.makedirs(local_tmp, exist_ok=True)
 
     # Build command
-    cmd = [ANSIBLE_BIN, "-i", inventory_path, playbook_path, "--limit", ",".join(hosts), "-u", effective_user]
+    cmd = [ANSIBLE_BIN, "-i", inventory_path, playbook_path, "--limit", limit, "-u", effective_user]
     if do_check:
         cmd.append("--check")
     if do_become:
@@ -502,26 +944,52 @@ def start_job(form):
         cmd += ["--tags", tags]
     if ssh_private_key:
         cmd += ["--private-key", ssh_private_key]
+    job_id = new_job_id()
+    jp = job_paths(job_id)
+    os.makedirs(jp["dir"], exist_ok=True)
+
+    # Secrets go in a private extra-vars file, not argv (visible in /proc/*/cmdline).
+    secret_vars = {}
     if ssh_pass:
-        cmd += ["-e", "ansible_password=%s" % ssh_pass]
+        secret_vars["ansible_password"] = ssh_pass
     if become_pass:
-        cmd += ["-e", "ansible_become_password=%s" % become_pass]
+        secret_vars["ansible_become_password"] = become_pass
+    vars_path = ""
+    if secret_vars:
+        fd = os.open(jp["vars"], os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(secret_vars, f)
+        cmd += ["-e", "@" + jp["vars"]]
+        vars_path = jp["vars"]
     if USE_SUDO:
         cmd = [SUDO_BIN, "-n", "--"] + cmd
 
-    env = os.environ.copy()
-    env["LANG"] = "C.UTF-8"
-    env["HOME"] = RUN_HOME
-    env["TMPDIR"] = RUN_TMP
-    env["ANSIBLE_LOCAL_TEMP"] = local_tmp
-    env["ANSIBLE_REMOTE_TMP"] = "/tmp"
-    env["ANSIBLE_HOST_KEY_CHECKING"] = "False"
-    env["ANSIBLE_SSH_ARGS"] = "-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null"
-    env["PYTHONUNBUFFERED"] = "1"
-
-    job_id = new_job_id()
-    jp = job_paths(job_id)
-    Path(jp["dir"]).mkdir(parents=True, exist_ok=True)
+    env = {
+        **os.environ,
+        "LANG": "C.UTF-8",
+        "HOME": RUN_HOME,
+        "TMPDIR": RUN_TMP,
+        "ANSIBLE_LOCAL_TEMP": local_tmp,
+        "ANSIBLE_REMOTE_TMP": "/tmp",
+        "ANSIBLE_HOST_KEY_CHECKING": "False",
+        # ansible defaults to 5 forks; run every selected host at once, up to MAX_FORKS.
+        "ANSIBLE_FORKS": str(max(5, min(MAX_FORKS, len(hosts)))),
+        # Reuse one SSH connection per host across tasks (ControlPersist) and run
+        # modules over it without the sftp copy step (pipelining). %C hashes the
+        # connection so the socket path stays short; RUN_TMP must be a local fs.
+        "ANSIBLE_PIPELINING": "True",
+        "ANSIBLE_SSH_ARGS": (
+            "-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null"
+            " -o ControlMaster=auto -o ControlPersist=60s -o ControlPath=" + RUN_TMP + "/cm-%C"
+        ),
+        # Gather facts only for hosts without cached ones; the cache lives next to
+        # the control sockets and expires after FACT_CACHE_TIMEOUT seconds.
+        "ANSIBLE_GATHERING": "smart",
+        "ANSIBLE_CACHE_PLUGIN": "jsonfile",
+        "ANSIBLE_CACHE_PLUGIN_CONNECTION": os.path.join(RUN_TMP, "factcache"),
+        "ANSIBLE_CACHE_PLUGIN_TIMEOUT": str(FACT_CACHE_TIMEOUT),
+        "PYTHONUNBUFFERED": "1",
+    }
 
     # Save a masked command (don't store secrets)
     masked_cmd = " ".join([safe(x) for x in (cmd[:4] + ["[...]"])])
@@ -538,38 +1006,106 @@ def start_job(form):
     }
     write_json(jp["meta"], meta)
 
-    logf = open(jp["log"], "w", buffering=1, encoding="utf-8", errors="replace")
+    # O_APPEND: the kernel places every write at EOF; the playbook writes
+    # straight to this fd with no buffering of ours in between.
+    log_fd = os.open(jp["log"], os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
     try:
-        proc = subprocess.Popen(
-            cmd,
-            stdout=logf,
-            stderr=subprocess.STDOUT,
-            env=env,
-            cwd=Path(playbook_path).parent
-        )
+        pid = spawn_job(cmd, env, os.path.dirname(playbook_path), log_fd, jp["rc"], vars_path)
     except Exception as e:
-        logf.write("Failed to start process: %s\n" % str(e))
-        logf.flush()
-        logf.close()
+        if vars_path:
+            try:
+                os.unlink(vars_path)
+            except OSError:
+                pass
+        os.write(log_fd, ("Failed to start process: %s\n" % str(e)).encode("utf-8", "replace"))
+        os.close(log_fd)
         header_ok(); print("<pre>%s</pre>" % safe(str(e))); return
+    os.close(log_fd)
 
-    meta["pid"] = proc.pid
+    meta["pid"] = pid
     write_json(jp["meta"], meta)
 
-    # Spawn a small watcher to write rc file when process exits (non-blocking)
-    # Use sh -c so it works on most systems
-    sh_cmd = "while kill -0 {pid} 2>/dev/null; do sleep 1; done; echo $? > {rc}".format(pid=proc.pid, rc=quote(jp["rc"]))
-    with open(os.devnull, "wb") as devnull:
-        subprocess.Popen(["sh", "-c", sh_cmd], stdout=devnull, stderr=devnull)
-
-    header_ok()
-    # Redirect user to watch page for this job
-    print("""<!DOCTYPE html>
-<html><head><meta http-equiv="refresh" content="0; URL=?action=watch&job=%s"></head>
-<body>Starting… <a href="?action=watch&job=%s">Continue</a></body></html>""" % (job_id, job_id))
+    # Answer with the watch page itself instead of a redirect to it: saves the
+    # browser a round trip, and whatever the playbook printed while we finished
+    # up (its banner, usually) is on the page from the start.
+    time.sleep(0.05)
+    initial, initial_pos, _ = _read_log_chunk(job_id, jp["log"], 0)
+    render_watch(form, job_id=job_id, preload_log=initial, preload_pos=initial_pos)
 
 
 # ---------------- POLL (tail) ----------------
+# job_id -> read-only log fd; reused across polls in a resident (WSGI) process.
+_LOG_READERS = {}
+_LOG_READERS_MAX = 64
+_LOG_READERS_LOCK = threading.Lock()
+
+
+def _log_reader(job_id, path):
+    fd = _LOG_READERS.get(job_id)
+    if fd is None:
+        if len(_LOG_READERS) >= _LOG_READERS_MAX:
+            _close_log_reader(next(iter(_LOG_READERS)))
+        fd = _LOG_READERS[job_id] = os.open(path, os.O_RDONLY)
+    return fd
+
+
+def _close_log_reader(job_id):
+    fd = _LOG_READERS.pop(job_id, None)
+    if fd is not None:
+        os.close(fd)
+
+
+def _utf8_complete_len(data):
+    """Length of data minus any trailing, incomplete UTF-8 sequence."""
+    n = len(data)
+    for i in range(1, min(4, n) + 1):
+        b = data[n - i]
+        if b < 0x80:
+            return n
+        if b >= 0xC0:
+            need = 2 if b < 0xE0 else (3 if b < 0xF0 else 4)
+            return n if i >= need else n - i
+    return n
+
+
+def _read_log_chunk(job_id, path, pos, final=False):
+    """Read up to 128 KiB of log from pos. Returns (text, new_pos, log_size).
+
+    A trailing, incomplete UTF-8 sequence is held back for the next read,
+    unless `final` (the job has exited): then nothing more will be written,
+    so the tail is decoded with replacement characters and pos reaches the end.
+    """
+    append = ""
+    sz = 0
+    if pos < 0:
+        pos = 0
+    try:
+        with _LOG_READERS_LOCK:
+            # Size from the already-open reader: one fstat, no path lookups.
+            fd = _log_reader(job_id, path)
+            sz = os.fstat(fd).st_size
+            # pread leaves the fd offset alone: no seek, and one fd serves every poller.
+            chunk = os.pread(fd, 128 * 1024, pos) if sz > pos else b""
+        if not (final and pos + len(chunk) >= sz):
+            chunk = chunk[:_utf8_complete_len(chunk)]
+        append = chunk.decode("utf-8", "replace")
+        pos += len(chunk)
+    except Exception:
+        pass  # no log yet (FileNotFoundError) or unreadable: report nothing new
+    return append, pos, sz
+
+
+def _read_rc(path):
+    """Exit code from rc.txt, or None while the job is still running."""
+    try:
+        with open(path, "rb") as f:
+            return int(f.read().strip() or b"1")
+    except FileNotFoundError:
+        return None
+    except Exception:
+        return 1
+
+
 def poll_job(form):
     header_ok("application/json; charset=utf-8")
     job_id = form.getfirst("job", "")
@@ -579,100 +1115,188 @@ def poll_job(form):
         pos = 0
     jp = job_paths(job_id)
     if not os.path.isdir(jp["dir"]):
-        print(json.dumps({"error": "no-such-job"})); return
+        sys.stdout.flush(); sys.stdout.buffer.write(_NO_SUCH_JOB); return
 
-    meta = read_json(jp["meta"], {})
-    start_ts = meta.get("start_ts", int(time.time()))
-    elapsed = int(time.time() - start_ts)
+    elapsed = int(time.time() - job_start_ts(job_id, jp))
 
-    append = ""
-    try:
-        sz = os.path.getsize(jp["log"]) if os.path.exists(jp["log"]) else 0
-        if pos < 0:
-            pos = 0
-        if sz > pos and os.path.exists(jp["log"]):
-            with open(jp["log"], "r", encoding="utf-8", errors="replace") as f:
-                f.seek(pos)
-                chunk = f.read(128 * 1024)
-                append = chunk
-                pos = f.tell()
-    except Exception:
-        pass
+    # rc.txt is written by the reaper after the playbook exits, so read it
+    # before the log: once it exists the log is complete and we are done
+    # as soon as this read reaches its end.
+    rc = _read_rc(jp["rc"])
+    append, pos, sz = _read_log_chunk(job_id, jp["log"], pos, rc is not None)
+    done = rc is not None and pos >= sz
 
-    rc = None
-    if os.path.exists(jp["rc"]):
-        try:
-            with open(jp["rc"], "r", encoding="utf-8", errors="replace") as f:
-                rc = int((f.read() or "1").strip())
-        except Exception:
-            rc = 1
+    if done:
+        with _LOG_READERS_LOCK:
+            _close_log_reader(job_id)
+    # Encoded straight to UTF-8 bytes: no per-character \uXXXX escaping of the log text.
+    sys.stdout.flush()
+    sys.stdout.buffer.write(json_bytes({"pos": pos, "append": append, "elapsed": elapsed, "done": done, "rc": rc}))
 
-    # If rc file exists, done; else if pid present check process_running
-    done = False
-    if rc is not None:
-        done = True
-    else:
-        pid = meta.get("pid")
-        if pid and process_running(int(pid)):
-            done = False
-        else:
-            # process not running and no rc file yet => still consider not done (watcher should create rc soon)
-            done = False
 
-    print(json.dumps({"pos": pos, "append": append, "elapsed": elapsed, "done": done, "rc": rc}))
+# ---------------- STREAM (Server-Sent Events) ----------------
+STREAM_MAX_SECS = 300      # end a stream after this long; the page reconnects from pos
+STREAM_INTERVAL_SECS = 0.5  # poll interval when inotify_simple is not installed
+STREAM_KEEPALIVE_SECS = 15
 
 
-# ---------------- WATCH PAGE ----------------
-def render_watch(form):
-    job_id = form.getfirst("job", "")
-    if not job_id:
-        header_ok(); print("<pre>Missing job id.</pre>"); return
+def _dir_watcher(path):
+    """inotify watch on a job dir (log appends, rc.txt rename), or None if unavailable."""
+    if inotify_simple is None:
+        return None
+    try:
+        ino = inotify_simple.INotify()
+        f = inotify_simple.flags
+        ino.add_watch(path, f.MODIFY | f.CLOSE_WRITE | f.CREATE | f.MOVED_TO)
+        return ino
+    except OSError:
+        return None
+
+
+def iter_job_events(job_id, pos=0):
+    """Yield SSE frames (bytes) carrying poll-style updates until the job is done."""
     jp = job_paths(job_id)
     if not os.path.isdir(jp["dir"]):
-        header_ok(); print("<pre>Unknown job.</pre>"); return
-
-    meta = read_json(jp["meta"], {})
-    start_ts = meta.get("start_ts", int(time.time()))
+        yield b"data: " + _NO_SUCH_JOB + b"\n\n"
+        return
+    start_ts = job_start_ts(job_id, jp)
+    deadline = time.time() + STREAM_MAX_SECS
+    last_sent = time.time()
+    watcher = _dir_watcher(jp["dir"])
+    try:
+        while True:
+            rc = _read_rc(jp["rc"])  # before the log, as in poll_job
+            prev = pos
+            append, pos, sz = _read_log_chunk(job_id, jp["log"], pos, rc is not None)
+            done = rc is not None and pos >= sz
+            now = time.time()
+            if append or done:
+                event = {"pos": pos, "append": append, "elapsed": int(now - start_ts), "done": done, "rc": rc}
+                yield b"data: " + json_bytes(event) + b"\n\n"
+                last_sent = now
+            elif now - last_sent >= STREAM_KEEPALIVE_SECS:
+                yield b": keepalive\n\n"
+                last_sent = now
+            if done:
+                with _LOG_READERS_LOCK:
+                    _close_log_reader(job_id)
+                return
+            if now >= deadline:
+                return
+            if prev < pos < sz:
+                continue  # this read made progress and more is buffered: send it without waiting
+            if watcher is not None:
+                # Sleep until the job dir changes; wake for the keepalive at the latest.
+                watcher.read(timeout=int(STREAM_KEEPALIVE_SECS * 1000), read_delay=50)
+            else:
+                time.sleep(STREAM_INTERVAL_SECS)
+    finally:
+        if watcher is not None:
+            watcher.close()
+
+
+def stream_job(form):
+    print("Content-Type: text/event-stream; charset=utf-8")
+    print("Cache-Control: no-cache")
+    print()
+    sys.stdout.flush()
+    try:
+        pos = int(form.getfirst("pos", "0"))
+    except Exception:
+        pos = 0
+    out = sys.stdout.buffer
+    try:
+        for frame in iter_job_events(form.getfirst("job", ""), pos):
+            out.write(frame)
+            out.flush()
+    except (BrokenPipeError, ConnectionResetError):
+        pass  # browser went away
 
-    now = int(time.time())
-    two_hours_ago = now - 2 * 3600
-    since_ts = start_ts if start_ts >= two_hours_ago else two_hours_ago
 
-    fresh_reports = find_reports(since_ts=since_ts, host_filter="")
-    fresh_links = []
-    for r in fresh_reports:
-        link = "?action=view_report&base={}&rel={}".format(quote(r["base"]), quote(r["rel"]))
-        fresh_links.append("<li><a href='{}' target='_blank'>{}</a> — {}</li>".format(
-            link, safe(r["file"]), time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(r["mtime"]))
-        ))
-
-    header_ok()
-    # embed job_id safely into JS using json.dumps so it's escaped correctly
-    print("""<!DOCTYPE html>
+# ---------------- WATCH PAGE ----------------
+# Static parts of the watch page; only the report list and job id vary.
+_WATCH_HEAD = """<!DOCTYPE html>
 <html>
 <head>
 <meta charset="utf-8" />
 <title>Running…</title>
 <style>
-  body {{ font-family: system-ui, -apple-system, Segoe UI, Roboto, Arial, sans-serif; margin: 24px; }}
-  .card {{ max-width: 1000px; margin: auto; padding: 20px; border: 1px solid #ddd; border-radius: 12px; box-shadow: 0 2px 6px rgba(0,0,0,.05); }}
-  .barwrap {{ height: 8px; background:#eee; border-radius: 999px; overflow:hidden; margin:12px 0 18px; }}
-  .bar {{ width:35%%; height:100%%; background:#0d6efd; animation: indet 1.5s infinite ease-in-out; }}
-  @keyframes indet {{ 0%%{{transform:translateX(-100%%)}} 50%%{{transform:translateX(30%%)}} 100%%{{transform:translateX(100%%)}} }}
-  .spinner {{ width:18px; height:18px; border:3px solid #0d6efd55; border-top-color:#0d6efd; border-radius:50%%; animation: spin .8s linear infinite; display:inline-block; vertical-align:middle; margin-right:8px; }}
-  @keyframes spin {{ to {{ transform: rotate(360deg); }} }}
-  pre {{ background:#0b1020; color:#d1e7ff; padding:12px; border-radius:8px; white-space:pre-wrap; max-height:520px; overflow:auto; }}
-  .muted {{ color:#666; }}
-  .actions {{ display:flex; gap:12px; margin-top:12px; align-items:center; }}
-  .btn {{ display:inline-flex; align-items:center; justify-content:center; height:40px; padding:0 16px; font-weight:600; font-size:14px; color:#fff; background:#0d6efd; border:0; border-radius:10px; text-decoration:none; cursor:pointer; }}
+  body { font-family: system-ui, -apple-system, Segoe UI, Roboto, Arial, sans-serif; margin: 24px; }
+  .card { max-width: 1000px; margin: auto; padding: 20px; border: 1px solid #ddd; border-radius: 12px; box-shadow: 0 2px 6px rgba(0,0,0,.05); }
+  .barwrap { height: 8px; background:#eee; border-radius: 999px; overflow:hidden; margin:12px 0 18px; }
+  .bar { width:35%; height:100%; background:#0d6efd; animation: indet 1.5s infinite ease-in-out; }
+  @keyframes indet { 0%{transform:translateX(-100%)} 50%{transform:translateX(30%)} 100%{transform:translateX(100%)} }
+  .spinner { width:18px; height:18px; border:3px solid #0d6efd55; border-top-color:#0d6efd; border-radius:50%; animation: spin .8s linear infinite; display:inline-block; vertical-align:middle; margin-right:8px; }
+  @keyframes spin { to { transform: rotate(360deg); } }
+  pre { background:#0b1020; color:#d1e7ff; padding:12px; border-radius:8px; white-space:pre-wrap; max-height:520px; overflow:auto; }
+  .muted { color:#666; }
+  .actions { display:flex; gap:12px; margin-top:12px; align-items:center; }
+  .btn { display:inline-flex; align-items:center; justify-content:center; height:40px; padding:0 16px; font-weight:600; font-size:14px; color:#fff; background:#0d6efd; border:0; border-radius:10px; text-decoration:none; cursor:pointer; }
 </style>
 </head>
 <body>
-  <div class="card">
+"""
+_WATCH_SCRIPT = """  var done = false;
+  function update(r) {
+    pos = r.pos;
+    document.getElementById('elapsed').textContent = 'Elapsed: ' + r.elapsed + 's';
+    if (r.append) {
+      var pre = document.getElementById('log');
+      if (!started) { pre.textContent = ''; started = true; }  // drop the placeholder
+      pre.textContent += r.append;
+      pre.scrollTop = pre.scrollHeight;
+    }
+    if (r.done) {
+      done = true;
+      document.getElementById('title').textContent = (r.rc === 0) ? '✅ SUCCESS' : ('❌ FAILED (rc=' + r.rc + ')');
+      document.querySelector('.barwrap').style.display = 'none';
+      var sp = document.querySelector('.spinner'); if (sp) sp.style.display = 'none';
+      document.getElementById('actions').style.display = 'flex';
+    }
+  }
+  function poll() {
+    if (done) return;
+    var xhr = new XMLHttpRequest();
+    xhr.open('GET', '?action=poll&job=' + encodeURIComponent(job) + '&pos=' + pos, true);
+    xhr.onreadystatechange = function() {
+      if (xhr.readyState === 4 && xhr.status === 200) {
+        try {
+          var r = JSON.parse(xhr.responseText);
+          update(r);
+          if (!r.done) setTimeout(poll, 2000);
+        } catch (e) {
+          setTimeout(poll, 3000);
+        }
+      } else if (xhr.readyState === 4) {
+        setTimeout(poll, 3000);
+      }
+    };
+    xhr.send();
+  }
+  function stream() {
+    var es = new EventSource('?action=stream&job=' + encodeURIComponent(job) + '&pos=' + pos);
+    es.onmessage = function(ev) {
+      var r = JSON.parse(ev.data);
+      if (r.error) { es.close(); return; }
+      update(r);
+      if (r.done) es.close();
+    };
+    es.onerror = function() {
+      // server ended the stream (time limit) or the connection dropped: resume from pos
+      es.close();
+      if (!done) setTimeout(stream, 2000);
+    };
+  }
+  if (window.EventSource) stream(); else poll();
+</script>
+</body></html>
+"""
+
+_WATCH_BODY = string.Template("""  <div class="card">
     <h1 id="title"><span class="spinner"></span>Running…</h1>
     <div class="barwrap"><div class="bar"></div></div>
     <div class="muted" id="elapsed">Elapsed: 0s</div>
-    <pre id="log">(connecting…)</pre>
+    <pre id="log">$log</pre>
     <div class="actions" id="actions" style="display:none">
       <a class="btn" href="">Run another</a>
       <a class="btn" href="?action=list_reports" target="_blank">Browse reports</a>
@@ -680,59 +1304,66 @@ def render_watch(form):
     <div id="fresh_reports" style="margin-top:16px;">
       <h3>Recent Reports (static snapshot)</h3>
       <ul>
-        {fresh}
+        $fresh
       </ul>
     </div>
   </div>
 
 <script>
-  var job = {job_json};
-  var pos = 0;
-  var done = false;
-  function poll() {{
-    if (done) return;
-    var xhr = new XMLHttpRequest();
-    xhr.open('GET', '?action=poll&job=' + encodeURIComponent(job) + '&pos=' + pos, true);
-    xhr.onreadystatechange = function() {{
-      if (xhr.readyState === 4 && xhr.status === 200) {{
-        try {{
-          var r = JSON.parse(xhr.responseText);
-          pos = r.pos;
-          document.getElementById('elapsed').textContent = 'Elapsed: ' + r.elapsed + 's';
-          if (r.append) {{
-            var pre = document.getElementById('log');
-            pre.textContent += r.append;
-            pre.scrollTop = pre.scrollHeight;
-          }}
-          if (r.done) {{
-            done = true;
-            document.getElementById('title').textContent = (r.rc === 0) ? '✅ SUCCESS' : ('❌ FAILED (rc=' + r.rc + ')');
-            document.querySelector('.barwrap').style.display = 'none';
-            var sp = document.querySelector('.spinner'); if (sp) sp.style.display = 'none';
-            document.getElementById('actions').style.display = 'flex';
-          }} else {{
-            setTimeout(poll, 2000);
-          }}
-        }} catch (e) {{
-          setTimeout(poll, 3000);
-        }}
-      }} else if (xhr.readyState === 4) {{
-        setTimeout(poll, 3000);
-      }}
-    }};
-    xhr.send();
-  }}
-  poll();
-</script>
-</body></html>
-""".format(fresh="\n".join(fresh_links), job_json=json.dumps(job_id)))
+  var job = $job;
+  var pos = $pos;
+  var started = $started;
+$replace""")
+
+
+def render_watch(form, job_id=None, preload_log="", preload_pos=0):
+    """Watch page for a job. start_job passes job_id directly, with the log
+    read so far (preload_log, ending at byte preload_pos) to seed the page."""
+    inline = job_id is not None
+    if not inline:
+        job_id = form.getfirst("job", "")
+    if not job_id:
+        header_ok(); print("<pre>Missing job id.</pre>"); return
+    jp = job_paths(job_id)
+    if not os.path.isdir(jp["dir"]):
+        header_ok(); print("<pre>Unknown job.</pre>"); return
+
+    start_ts = job_start_ts(job_id, jp)
+
+    now = int(time.time())
+    two_hours_ago = now - 2 * 3600
+    since_ts = start_ts if start_ts >= two_hours_ago else two_hours_ago
+
+    fresh_reports = find_reports(since_ts=since_ts, host_filter="")
+    fresh_links = []
+    for r in fresh_reports:
+        link = "?action=view_report&base={}&rel={}".format(quote(r["base"]), quote(r["rel"]))
+        fresh_links.append("<li><a href='{}' target='_blank'>{}</a> — {}</li>".format(
+            link, safe(r["file"]), time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(r["mtime"]))
+        ))
+
+    header_ok()
+    out = sys.stdout
+    out.write(_WATCH_HEAD)
+    out.write(_WATCH_BODY.substitute(
+        log=safe(preload_log) if preload_pos else "(connecting…)",
+        fresh="\n".join(fresh_links),
+        job=json.dumps(job_id),  # json.dumps quotes the id for JS
+        pos=preload_pos,
+        started="true" if preload_pos else "false",
+        # served in answer to the start POST: make reload re-watch, not re-run
+        replace="  history.replaceState(null, '', '?action=watch&job=' + encodeURIComponent(job));\n" if inline else "",
+    ))
+    out.write(_WATCH_SCRIPT)
 
 
 # ---------------- MAIN ----------------
-def main():
+def handle(method, form):
+    """Dispatch one request; handlers write a CGI-style response to stdout."""
+    if form is None:
+        print("Status: 413 Request Entity Too Large")
+        header_ok(); print("<pre>Request too large.</pre>"); return
     try:
-        method = os.environ.get("REQUEST_METHOD", "GET").upper()
-        form = cgi.FieldStorage()
         action = form.getfirst("action", "")
         if method == "POST" and action == "start":
             start_job(form)
@@ -740,6 +1371,8 @@ def main():
             render_watch(form)
         elif method == "GET" and action == "poll":
             poll_job(form)
+        elif method == "GET" and action == "stream":
+            stream_job(form)
         elif method == "GET" and action == "list_reports":
             render_list_reports(form)
         elif method == "GET" and action == "view_report":
@@ -747,10 +1380,91 @@ def main():
         else:
             render_form("", form)
     except Exception:
-        header_ok()
         import traceback
-        print("<pre>%s</pre>" % safe(traceback.format_exc()))
+        tb = traceback.format_exc()
+        sys.stderr.write(tb)
+        header_ok()
+        if DEBUG:
+            print("<pre>%s</pre>" % safe(tb))
+        else:
+            print("<pre>Internal error (details in the server error log).</pre>")
+
+
+def main():
+    method = os.environ.get("REQUEST_METHOD", "GET").upper()
+    handle(method, parse_form(os.environ, sys.stdin.buffer))
+
+
+class _ThreadStdout(object):
+    """sys.stdout stand-in that sends writes to a per-thread capture stream."""
+
+    def __init__(self, default):
+        self._default = default
+        self._local = threading.local()
+
+    def capture(self, stream):
+        self._local.stream = stream
+
+    def __getattr__(self, name):
+        return getattr(getattr(self._local, "stream", None) or self._default, name)
+
+
+def application(environ, start_response):
+    """WSGI entry point.
+
+    Handlers print CGI output, so stdout is captured per thread for the request
+    and the leading header block is split off into the WSGI status/headers.
+    """
+    if not isinstance(sys.stdout, _ThreadStdout):
+        sys.stdout = _ThreadStdout(sys.stdout)
+    method = environ.get("REQUEST_METHOD", "GET").upper()
+    form = parse_form(environ, environ["wsgi.input"])
+
+    if form is not None and method == "GET" and form.getfirst("action") == "stream":
+        # Long-lived response: hand the frame generator to the server unbuffered.
+        try:
+            pos = int(form.getfirst("pos", "0"))
+        except Exception:
+            pos = 0
+        start_response("200 OK", [
+            ("Content-Type", "text/event-stream; charset=utf-8"),
+            ("Cache-Control", "no-cache"),
+        ])
+        return iter_job_events(form.getfirst("job", ""), pos)
+
+    buf = io.BytesIO()
+    out = io.TextIOWrapper(buf, encoding="utf-8", write_through=True)
+    sys.stdout.capture(out)
+    try:
+        handle(method, form)
+        out.flush()
+    finally:
+        sys.stdout.capture(None)
+    raw = buf.getvalue()
+    out.detach()
+
+    head, sep, body = raw.partition(b"\n\n")
+    if not sep:
+        head, body = b"", raw
+    status = "200 OK"
+    headers = []
+    for line in head.decode("latin-1").splitlines():
+        name, _, value = line.partition(":")
+        if name.strip().lower() == "status":
+            status = value.strip()
+        elif name.strip().lower() == "content-length":
+            continue  # recomputed from the captured body below
+        elif name.strip():
+            headers.append((name.strip(), value.strip()))
+    if not headers:
+        headers.append(("Content-Type", "text/html; charset=utf-8"))
+    headers.append(("Content-Length", str(len(body))))
+    start_response(status, headers)
+    return [body]
 
 
 if __name__ == "__main__":
-    main()
+    if "GATEWAY_INTERFACE" not in os.environ and sys.argv[1:] == ["--index-reports"]:
+        index_reports_forever()
+    else:
+        main()
@@ -5,22 +5,37 @@ Ansible Playbook CGI Runner — full rewrite with report browsing
 - Keeps original UI and behaviour
 - Adds report listing + safe viewing
 - Watch page shows logs + static recent reports (since run start or last 2h)
+
+Runs as a plain CGI script, or as a long-lived WSGI app via `application`
+(inventory cache, compiled tables and imports then survive between requests):
+    WSGIDaemonProcess ansible-runner processes=2 threads=8
+    WSGIScriptAlias /runner /var/www/cgi-bin/runner4.py process-group=ansible-runner
 """
 from __future__ import annotations
-import cgi
-import cgitb
+import functools
+import heapq
 import html
+import io
 import json
 import os
-import re
 import shutil
+import string
 import subprocess
 import sys
+import threading
 import time
 from pathlib import Path
-from urllib.parse import quote, unquote
+from urllib.parse import parse_qsl, quote, unquote
+
+try:
+    import orjson
+except ImportError:  # optional: stdlib json fallback
+    orjson = None
 
-cgitb.enable()
+try:
+    import inotify_simple
+except ImportError:  # optional: streams fall back to timed polling
+    inotify_simple = None
 
 # ---------------- CONFIG ----------------
 PLAYBOOKS = {
@@ -44,21 +59,67 @@ INVENTORIES = {
 
 # Where playbooks may deposit HTML reports. Adjust as needed.
 REPORT_BASES = ["/tmp"]
+WATCH_MAX_REPORTS = 100  # newest reports listed on the watch page
+
+def _find_bin(name: str, default: str) -> str:
+    """The usual install path if it is there (one access() call); a PATH search only if not."""
+    if os.access(default, os.X_OK):
+        return default
+    return shutil.which(name) or default
+
 
-ANSIBLE_BIN = shutil.which("ansible-playbook") or "/usr/bin/ansible-playbook"
+ANSIBLE_BIN = _find_bin("ansible-playbook", "/usr/bin/ansible-playbook")
 DEFAULT_USER = os.environ.get("ANSIBLE_SSH_USER", "ansadmin")
 RUN_TIMEOUT_SECS = 8 * 3600
+MAX_POLL_BYTES = 256 * 1024  # log bytes returned per poll; the client keeps polling for the rest
+MAX_FORM_BYTES = 4 * 1024 * 1024  # larger POST bodies get 413
 
 USE_SUDO = False
-SUDO_BIN = shutil.which("sudo") or "/usr/bin/sudo"
+SUDO_BIN = _find_bin("sudo", "/usr/bin/sudo")
+BASH_BIN = _find_bin("bash", "/bin/bash")
 
 RUN_HOME = "/tmp/www-ansible/home"
 RUN_TMP  = "/tmp/www-ansible/tmp"
 JOB_DIR  = "/tmp/www-ansible/tmp"
 
-HOST_RE = re.compile(r"^[A-Za-z0-9_.-]+$")
-USER_RE = re.compile(r"^[A-Za-z0-9_.-]+$")
-TAGS_RE = re.compile(r"^[A-Za-z0-9_,.-]+$")
+# Environment for ansible-playbook runs
+_RUN_ENV = {
+    **os.environ,
+    "LANG": "C.UTF-8",
+    "HOME": RUN_HOME,
+    "TMPDIR": RUN_TMP,
+    "ANSIBLE_LOCAL_TEMP": os.path.join(RUN_TMP, "ansible-local"),
+    "ANSIBLE_REMOTE_TMP": "/tmp",
+    "ANSIBLE_HOST_KEY_CHECKING": "False",
+    "ANSIBLE_SSH_ARGS": "-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null",
+    "PYTHONUNBUFFERED": "1",
+}
+
+# Input validation: allowed characters as translate() deletion tables (valid = nothing left)
+_NAME_CHARS = string.ascii_letters + string.digits + "_.-"
+_NAME_DEL = str.maketrans("", "", _NAME_CHARS)
+_LIST_DEL = str.maketrans("", "", _NAME_CHARS + ",")
+
+
+def is_host(s: str) -> bool:
+    return bool(s) and len(s) <= 253 and not s.translate(_NAME_DEL)
+
+
+def first_bad_host(hosts) -> str | None:
+    """Return the first invalid name in hosts, or None if all are valid."""
+    if ("" not in hosts and max(map(len, hosts), default=0) <= 253
+            and ",".join(hosts).translate(_NAME_DEL) == "," * (len(hosts) - 1)):
+        return None
+    return next((h for h in hosts if not is_host(h)), None)
+
+
+def is_user(s: str) -> bool:
+    return bool(s) and not s.translate(_NAME_DEL)
+
+
+def is_name_list(s: str) -> bool:
+    """Comma-separated names (--tags, --limit)."""
+    return bool(s) and not s.translate(_LIST_DEL)
 
 # ---------------- UTIL ----------------
 def header_ok(ct: str = "text/html; charset=utf-8"):
@@ -70,6 +131,39 @@ def safe(s: str) -> str:
     return html.escape("" if s is None else str(s))
 
 
+class Form(dict):
+    """Minimal stand-in for cgi.FieldStorage: {name: [values]} with getfirst/getlist."""
+
+    def getfirst(self, key, default=None):
+        values = self.get(key)
+        return values[0] if values else default
+
+    def getlist(self, key):
+        return list(self.get(key, ()))
+
+
+def parse_form(environ, stream) -> Form | None:
+    """Parse an urlencoded POST body plus QUERY_STRING (no file uploads needed).
+
+    Returns None for a body over MAX_FORM_BYTES; the caller answers 413.
+    """
+    pairs = []
+    if environ.get("REQUEST_METHOD", "GET").upper() == "POST":
+        try:
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            length = 0
+        if length > MAX_FORM_BYTES:
+            return None
+        if length > 0:
+            pairs += parse_qsl(stream.read(length).decode("utf-8", "replace"))
+    pairs += parse_qsl(environ.get("QUERY_STRING", ""))
+    form = Form()
+    for k, v in pairs:
+        form.setdefault(k, []).append(v)
+    return form
+
+
 def ensure_dirs():
     Path(RUN_HOME).mkdir(parents=True, exist_ok=True)
     Path(RUN_TMP).mkdir(parents=True, exist_ok=True)
@@ -91,67 +185,89 @@ def job_paths(job_id: str):
     }
 
 
+def json_bytes(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data).encode("utf-8")
+
+
 def write_json(path: str, data):
-    with open(path, "w") as f:
-        json.dump(data, f)
+    """Write JSON atomically (tmp file + rename) so pollers never see a torn file."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(json_bytes(data))
+    os.replace(tmp, path)
 
 
 def read_json(path: str, default=None):
     try:
-        with open(path, "r") as f:
-            return json.load(f)
+        with open(path, "rb") as f:
+            data = f.read()
+        if orjson is not None:
+            return orjson.loads(data)
+        return json.loads(data.decode("utf-8"))
     except Exception:
         return default
 
 
-def process_running(pid):
-    try:
-        os.kill(pid, 0)
-        return True
-    except Exception:
-        return False
-
 # ---------------- INVENTORY PARSING ----------------
 def parse_ini_inventory_groups(path: str):
     """Parse simple INI inventory into {group: [hosts]} (best-effort)."""
     groups = {}
-    current = None
-    if not os.path.exists(path):
+    members = None  # host set of the current section; None inside [x:vars] / [x:children]
+    try:
+        f = open(path, "r", encoding="utf-8", errors="replace")
+    except OSError:
         return {}
-    with open(path, "r", encoding="utf-8", errors="replace") as f:
+    with f:
         for raw in f:
             line = raw.strip()
-            if not line or line.startswith("#") or line.startswith(";"):
+            if not line or line[0] in "#;":
                 continue
-            if line.startswith("[") and line.endswith("]"):
-                current = line[1:-1].strip()
-                groups.setdefault(current, [])
+            if line[0] == "[" and line[-1] == "]":
+                section = line[1:-1].strip()
+                # [web:vars] holds key=value pairs and [web:children] group names, not hosts
+                members = None if ":" in section else groups.setdefault(section, set())
                 continue
-            if current:
-                token = line.split()[0].split("=")[0].strip()
+            if members is not None:
+                token = line.split(None, 1)[0].split("=", 1)[0]
                 if token:
-                    if token not in groups[current]:
-                        groups[current].append(token)
+                    members.add(token)
     for k in ("all", "ungrouped"):
         if k in groups and not groups[k]:
             groups.pop(k, None)
-    for k in groups:
-        groups[k] = sorted(groups[k], key=str.lower)
-    return dict(sorted(groups.items(), key=lambda kv: kv[0].lower()))
+    return {k: sorted(groups[k], key=str.lower) for k in sorted(groups, key=str.lower)}
+
+
+# path -> ((st_mtime_ns, st_size, st_ino), (groups_map, all_hosts, host_groups))
+_INV_CACHE = {}
+_INV_CACHE_LOCK = threading.Lock()
 
 
 def get_inventory_maps(inv_key: str):
+    """Return (groups_map, all_hosts, host_groups), re-parsed only when the file changes."""
     meta = INVENTORIES.get(inv_key or "", {})
     path = meta.get("path", "")
     if not path:
         return {}, [], {}
+    try:
+        st = os.stat(path)
+    except OSError:
+        return {}, [], {}
+    sig = (st.st_mtime_ns, st.st_size, st.st_ino)
+    cached = _INV_CACHE.get(path)
+    if cached and cached[0] == sig:
+        return cached[1]
     groups_map = parse_ini_inventory_groups(path)
     host_groups = {}
     for g, hosts in groups_map.items():
         for h in hosts:
             host_groups.setdefault(h, []).append(g)
     all_hosts = sorted(host_groups.keys(), key=str.lower)
-    return groups_map, all_hosts, host_groups
+    result = (groups_map, all_hosts, host_groups)
+    with _INV_CACHE_LOCK:
+        _INV_CACHE[path] = (sig, result)
+    return result
 
 # ---------------- REPORT HELPERS ----------------
 def _is_safe_relpath(rel: str) -> bool:
@@ -164,48 +280,71 @@ def _is_safe_relpath(rel: str) -> bool:
     return True
 
 
-def find_reports(since_ts: int | None = None, host_filter: str = ""):
+def _scan_reports(base: str, top: str, since_ts, host_filter: str, out: list):
+    """Append matching .html reports under `top` to `out` (os.scandir, depth-first)."""
+    try:
+        it = os.scandir(top)
+    except OSError:
+        return
+    with it:
+        for entry in it:
+            try:
+                if entry.is_dir():
+                    if not entry.is_symlink():  # like os.walk: list, but don't follow
+                        _scan_reports(base, entry.path, since_ts, host_filter, out)
+                    continue
+                name = entry.name
+                # name checks first: they need no stat at all
+                if not name.lower().endswith(".html"):
+                    continue
+                if host_filter and host_filter not in name.lower():
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue
+            if since_ts and st.st_mtime < since_ts:
+                continue
+            out.append({
+                "file": name,
+                "path": entry.path,
+                "mtime": int(st.st_mtime),
+                "base": base,
+                "rel": os.path.relpath(entry.path, base),
+            })
+
+
+@functools.lru_cache(maxsize=4096)
+def _fmt_ts(ts: int) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts))
+
+
+def find_reports(since_ts: int | None = None, host_filter: str = "", max_results: int | None = None):
     """
     Scan REPORT_BASES for .html reports.
     - since_ts: optional epoch; include files with mtime >= since_ts
     - host_filter: substring to match in filename (case-insensitive)
-    Returns a list of dicts: file, path, mtime, base, rel
+    - max_results: optional cap; keeps only the newest N
+    Returns a list of dicts (newest first): file, path, mtime, base, rel,
+    plus the display-ready mtime_str and view link
     """
     results = []
+    host_filter = host_filter.lower()
     for base in REPORT_BASES:
-        if not os.path.isdir(base):
-            continue
-        for root, dirs, files in os.walk(base):
-            for f in files:
-                if not f.lower().endswith(".html"):
-                    continue
-                path = os.path.join(root, f)
-                try:
-                    st = os.stat(path)
-                except Exception:
-                    continue
-                if since_ts and st.st_mtime < since_ts:
-                    continue
-                if host_filter and host_filter.lower() not in f.lower():
-                    continue
-                rel = os.path.relpath(path, base)
-                results.append({
-                    "file": f,
-                    "path": path,
-                    "mtime": int(st.st_mtime),
-                    "base": base,
-                    "rel": rel
-                })
-    results.sort(key=lambda r: r["mtime"], reverse=True)
+        _scan_reports(base, base, since_ts, host_filter, results)
+    if max_results is not None and len(results) > max_results:
+        results = heapq.nlargest(max_results, results, key=lambda r: r["mtime"])
+    else:
+        results.sort(key=lambda r: r["mtime"], reverse=True)
+    # Formatted only for the rows that survive the cap; each base is quoted once.
+    # link uses base and rel; since base may contain slashes we round-trip via quote
+    base_q = {base: quote(base) for base in REPORT_BASES}
+    for r in results:
+        r["mtime_str"] = _fmt_ts(r["mtime"])
+        r["link"] = "?action=view_report&base={}&rel={}".format(base_q[r["base"]], quote(r["rel"]))
     return results
 
 
-def render_list_reports(form: cgi.FieldStorage):
-    header_ok()
-    host_filter = (form.getfirst("host") or "").strip()
-    since = int(time.time()) - 24*3600
-    reports = find_reports(since_ts=since, host_filter=host_filter)
-    print("""<!DOCTYPE html>
+_REPORTS_HEAD = """<!DOCTYPE html>
 <html><head><meta charset="utf-8" />
 <title>Reports</title>
 <style>
@@ -217,7 +356,16 @@ def render_list_reports(form: cgi.FieldStorage):
  a:hover { text-decoration:underline; }
 </style></head><body>
 <h1>Reports (last 24h)</h1>
-<form method="get">
+"""
+
+
+def render_list_reports(form: Form):
+    header_ok()
+    host_filter = (form.getfirst("host") or "").strip()
+    since = int(time.time()) - 24*3600
+    reports = find_reports(since_ts=since, host_filter=host_filter)
+    sys.stdout.write(_REPORTS_HEAD)
+    print("""<form method="get">
   <input type="hidden" name="action" value="list_reports"/>
   <input type="text" name="host" placeholder="Filter by host substring" value="{filt}"/>
   <button type="submit">Filter</button>
@@ -228,15 +376,12 @@ def render_list_reports(form: cgi.FieldStorage):
     if not reports:
         print("<tr><td colspan=4><em>No reports found.</em></td></tr>")
     for r in reports:
-        ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(r["mtime"]))
-        # link uses base index and rel; since base may contain slashes we round-trip via quote
-        link = "?action=view_report&base={}&rel={}".format(quote(r["base"]), quote(r["rel"]))
         print("<tr><td>{}</td><td>{}</td><td>{}</td><td><a href='{}' target='_blank'>View</a></td></tr>".format(
-            safe(r["file"]), ts, safe(r["base"]), link))
+            safe(r["file"]), r["mtime_str"], safe(r["base"]), r["link"]))
     print("</table></body></html>")
 
 
-def render_view_report(form: cgi.FieldStorage):
+def render_view_report(form: Form):
     # base and rel are expected to have been quoted in list_reports
     base_q = form.getfirst("base") or ""
     rel_q = form.getfirst("rel") or ""
@@ -263,22 +408,147 @@ def render_view_report(form: cgi.FieldStorage):
     except Exception:
         header_ok(); print("<pre>Access validation error</pre>"); return
 
-    if not os.path.isfile(full):
+    # Open first: a missing file or a directory is reported without a separate stat.
+    try:
+        f = open(full, "rb")
+    except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
         header_ok(); print("<pre>Report not found</pre>"); return
-
-    # Serve as HTML; the report is likely a full HTML document
-    header_ok("text/html; charset=utf-8")
+    except OSError as e:
+        header_ok(); print("<pre>Failed to read report: %s</pre>" % safe(str(e))); return
+
+    # Serve as HTML; the report is likely a full HTML document. Its bytes are
+    # passed through as-is, never decoded.
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        print("Content-Type: text/html; charset=utf-8")
+        print("Content-Length: %d" % size)
+        print()
+        sys.stdout.flush()
+        _send_file(f, size)
+
+
+def _send_file(src, size: int):
+    """Copy `size` bytes of src to stdout: os.sendfile when stdout is a real fd
+    (CGI), else 64 KiB reads (WSGI)."""
+    out = sys.stdout.buffer
+    sent = 0
     try:
-        with open(full, "r", encoding="utf-8", errors="replace") as f:
-            sys.stdout.write(f.read())
-    except Exception as e:
-        header_ok(); print("<pre>Failed to read report: %s</pre>" % safe(str(e)))
+        out_fd = out.fileno()
+    except (AttributeError, OSError):
+        out_fd = None
+    if out_fd is not None:
+        try:
+            while sent < size:
+                n = os.sendfile(out_fd, src.fileno(), sent, size - sent)
+                if n == 0:
+                    break
+                sent += n
+            return
+        except OSError:
+            if sent:
+                raise  # part of the body is already out; cannot switch methods now
+    src.seek(sent)
+    while sent < size:
+        block = src.read(min(65536, size - sent))
+        if not block:
+            break
+        out.write(block)
+        sent += len(block)
 
 # ---------------- RENDER FORM ----------------
-def render_form(msg: str = "", form: cgi.FieldStorage = None):
+# Static page chrome, kept out of the per-request formatting.
+_FORM_HEAD = """<!DOCTYPE html>
+<html>
+<head>
+  <meta charset="utf-8" />
+  <title>Ansible Playbook CGI Runner</title>
+  <style>
+    body { font-family: system-ui, -apple-system, Segoe UI, Roboto, Arial, sans-serif; margin: 24px; }
+    .card { max-width: 900px; margin: auto; padding: 20px; border: 1px solid #ddd; border-radius: 12px; box-shadow: 0 2px 6px rgba(0,0,0,.05); }
+    h1 { margin-top: 0; }
+    label { display:block; margin: 12px 0 6px; font-weight: 600; }
+    select, input[type=text], input[type=password] { width: 100%; padding: 10px; border: 1px solid #ccc; border-radius: 8px; }
+    .row { display: grid; grid-template-columns: 1fr 1fr; gap: 16px; }
+    .muted { color: #666; font-size: 0.95em; }
+    .warn { background: #fff3cd; border: 1px solid #ffeeba; padding: 8px 12px; border-radius: 8px; }
+    .group-grid { display: grid; grid-template-columns: repeat(3, minmax(0, 1fr)); grid-gap: 8px; }
+    .hosts-box { max-height: 260px; overflow-y: auto; padding: 8px; border: 1px solid #eee; border-radius: 8px; background:#fff; }
+    .toolbar { display:flex; gap:8px; margin: 6px 0 10px; }
+    .tbtn { padding:6px 10px; border:1px solid #ccc; border-radius:6px; background:#f8f9fa; cursor:pointer; }
+    .actions { display:flex; gap:16px; margin-top:16px; align-items:center; }
+    .btn, .btn:link, .btn:visited {
+      display:inline-flex; align-items:center; justify-content:center;
+      height:44px; padding:0 18px; font-weight:600; font-size:16px; line-height:1;
+      color:#fff; background:#0d6efd; border:0; border-radius:10px; text-decoration:none; cursor:pointer;
+      box-shadow:0 1px 2px rgba(0,0,0,.06), 0 4px 14px rgba(13,110,253,.25);
+      transition:background .15s ease, transform .02s ease; appearance:none;
+    }
+    button.btn { border:0; }
+    .btn:hover { background:#0b5ed7; }
+    .btn:active { transform:translateY(1px); }
+  </style>
+  <script>
+    function selectAllHosts(val) {
+      var boxes = document.querySelectorAll('input[name="hosts"]');
+      for (var i=0; i<boxes.length; i++) { boxes[i].checked = val; }
+    }
+    function toggleInventorySubmit() {
+      document.getElementById('action').value = 'refresh';
+      document.getElementById('runnerForm').submit();
+    }
+    function onPlaybookChanged() {
+      document.getElementById('action').value = 'refresh';
+      document.getElementById('runnerForm').submit();
+    }
+    function syncRegionToHosts() {
+      var selected = new Set();
+      var r = document.querySelectorAll('input[name="regions"]:checked');
+      for (var i=0;i<r.length;i++) selected.add(r[i].value);
+      var hosts = document.querySelectorAll('input[name="hosts"]');
+      for (var j=0;j<hosts.length;j++) {
+        var cb = hosts[j];
+        var groups = (cb.getAttribute('data-groups') || '').split(',');
+        var match = false;
+        for (var k=0;k<groups.length;k++) { if (selected.has(groups[k])) { match = true; break; } }
+        if (selected.size > 0) { cb.checked = match; }
+      }
+    }
+    document.addEventListener('DOMContentLoaded', function() {
+      var regionCbs = document.querySelectorAll('input[name="regions"]');
+      for (var i=0;i<regionCbs.length;i++) regionCbs[i].addEventListener('change', syncRegionToHosts);
+      syncRegionToHosts();
+    });
+  </script>
+</head>
+<body>
+  <div class="card">
+    <h1>Ansible Playbook CGI Runner</h1>
+"""
+_FORM_TAIL = """      <label for="password">SSH password (optional)</label>
+      <input id="password" name="password" type="password" />
+      <label for="become_pass">Become password (optional)</label>
+      <input id="become_pass" name="become_pass" type="password" />
+
+      <div class="actions">
+        <button class="btn" type="submit" onclick="document.getElementById('action').value='start'">Run Playbook</button>
+        <a class="btn" href="?action=list_reports" style="background:#198754; text-decoration:none;">Browse reports</a>
+      </div>
+    </form>
+  </div>
+</body>
+</html>
+"""
+
+
+# Config keys and labels are fixed at deploy time: escape them once at import.
+_PLAYBOOK_CHOICES = [(k, safe(k), safe(v["label"])) for k, v in PLAYBOOKS.items()]
+_INVENTORY_CHOICES = {k: (safe(k), safe(v["label"])) for k, v in INVENTORIES.items()}
+
+
+def render_form(msg: str = "", form: Form = None):
     header_ok()
     if form is None:
-        form = cgi.FieldStorage()
+        form = Form()
 
     selected_playbook = form.getfirst("playbook", "")
     inventory_key     = form.getfirst("inventory_key", "")
@@ -294,15 +564,15 @@ def render_form(msg: str = "", form: cgi.FieldStorage = None):
 
     playbook_opts = "\n".join(
         '<option value="{k}" {sel}>{lbl}</option>'.format(
-            k=safe(k), lbl=safe(v["label"]), sel=("selected" if k == selected_playbook else "")
+            k=k_html, lbl=lbl_html, sel=("selected" if k == selected_playbook else "")
         )
-        for k, v in PLAYBOOKS.items()
+        for k, k_html, lbl_html in _PLAYBOOK_CHOICES
     )
     inv_opts = "\n".join(
         '<option value="{k}" {sel}>{lbl}</option>'.format(
-            k=safe(k), lbl=safe(INVENTORIES[k]["label"]), sel=("selected" if k == inventory_key else "")
+            k=_INVENTORY_CHOICES[k][0], lbl=_INVENTORY_CHOICES[k][1], sel=("selected" if k == inventory_key else "")
         )
-        for k in allowed_invs if k in INVENTORIES
+        for k in allowed_invs if k in _INVENTORY_CHOICES
     )
 
     if groups_map:
@@ -338,74 +608,11 @@ def render_form(msg: str = "", form: cgi.FieldStorage = None):
     check_val  = "checked" if form.getfirst("check") else ""
     become_val = "checked" if (form.getfirst("become") or not form) else ""
     msg_html   = ("<div class='warn'>{}</div>".format(safe(msg))) if msg else ""
+    sel_pb     = "selected" if not selected_playbook else ""
 
-    print("""<!DOCTYPE html>
-<html>
-<head>
-  <meta charset="utf-8" />
-  <title>Ansible Playbook CGI Runner</title>
-  <style>
-    body {{ font-family: system-ui, -apple-system, Segoe UI, Roboto, Arial, sans-serif; margin: 24px; }}
-    .card {{ max-width: 900px; margin: auto; padding: 20px; border: 1px solid #ddd; border-radius: 12px; box-shadow: 0 2px 6px rgba(0,0,0,.05); }}
-    h1 {{ margin-top: 0; }}
-    label {{ display:block; margin: 12px 0 6px; font-weight: 600; }}
-    select, input[type=text], input[type=password] {{ width: 100%; padding: 10px; border: 1px solid #ccc; border-radius: 8px; }}
-    .row {{ display: grid; grid-template-columns: 1fr 1fr; gap: 16px; }}
-    .muted {{ color: #666; font-size: 0.95em; }}
-    .warn {{ background: #fff3cd; border: 1px solid #ffeeba; padding: 8px 12px; border-radius: 8px; }}
-    .group-grid {{ display: grid; grid-template-columns: repeat(3, minmax(0, 1fr)); grid-gap: 8px; }}
-    .hosts-box {{ max-height: 260px; overflow-y: auto; padding: 8px; border: 1px solid #eee; border-radius: 8px; background:#fff; }}
-    .toolbar {{ display:flex; gap:8px; margin: 6px 0 10px; }}
-    .tbtn {{ padding:6px 10px; border:1px solid #ccc; border-radius:6px; background:#f8f9fa; cursor:pointer; }}
-    .actions {{ display:flex; gap:16px; margin-top:16px; align-items:center; }}
-    .btn, .btn:link, .btn:visited {{
-      display:inline-flex; align-items:center; justify-content:center;
-      height:44px; padding:0 18px; font-weight:600; font-size:16px; line-height:1;
-      color:#fff; background:#0d6efd; border:0; border-radius:10px; text-decoration:none; cursor:pointer;
-      box-shadow:0 1px 2px rgba(0,0,0,.06), 0 4px 14px rgba(13,110,253,.25);
-      transition:background .15s ease, transform .02s ease; appearance:none;
-    }}
-    button.btn {{ border:0; }}
-    .btn:hover {{ background:#0b5ed7; }}
-    .btn:active {{ transform:translateY(1px); }}
-  </style>
-  <script>
-    function selectAllHosts(val) {{
-      var boxes = document.querySelectorAll('input[name="hosts"]');
-      for (var i=0; i<boxes.length; i++) {{ boxes[i].checked = val; }}
-    }}
-    function toggleInventorySubmit() {{
-      document.getElementById('action').value = 'refresh';
-      document.getElementById('runnerForm').submit();
-    }}
-    function onPlaybookChanged() {{
-      document.getElementById('action').value = 'refresh';
-      document.getElementById('runnerForm').submit();
-    }}
-    function syncRegionToHosts() {{
-      var selected = new Set();
-      var r = document.querySelectorAll('input[name="regions"]:checked');
-      for (var i=0;i<r.length;i++) selected.add(r[i].value);
-      var hosts = document.querySelectorAll('input[name="hosts"]');
-      for (var j=0;j<hosts.length;j++) {{
-        var cb = hosts[j];
-        var groups = (cb.getAttribute('data-groups') || '').split(',');
-        var match = false;
-        for (var k=0;k<groups.length;k++) {{ if (selected.has(groups[k])) {{ match = true; break; }} }}
-        if (selected.size > 0) {{ cb.checked = match; }}
-      }}
-    }}
-    document.addEventListener('DOMContentLoaded', function() {{
-      var regionCbs = document.querySelectorAll('input[name="regions"]');
-      for (var i=0;i<regionCbs.length;i++) regionCbs[i].addEventListener('change', syncRegionToHosts);
-      syncRegionToHosts();
-    }});
-  </script>
-</head>
-<body>
-  <div class="card">
-    <h1>Ansible Playbook CGI Runner</h1>
-    {msg_html}
+    out = sys.stdout
+    out.write(_FORM_HEAD)
+    out.write(f"""    {msg_html}
     <form id="runnerForm" method="post" action="">
       <input type="hidden" name="action" id="action" value="refresh" />
 
@@ -450,34 +657,20 @@ def render_form(msg: str = "", form: cgi.FieldStorage = None):
       <label><input type="checkbox" name="check" value="1" {check_val}/> Dry run (--check)</label>
       <label><input type="checkbox" name="become" value="1" {become_val}/> Become (-b)</label>
 
-      <label for="password">SSH password (optional)</label>
-      <input id="password" name="password" type="password" />
-      <label for="become_pass">Become password (optional)</label>
-      <input id="become_pass" name="become_pass" type="password" />
+""")
+    out.write(_FORM_TAIL)
+    out.flush()
 
-      <div class="actions">
-        <button class="btn" type="submit" onclick="document.getElementById('action').value='start'">Run Playbook</button>
-        <a class="btn" href="?action=list_reports" style="background:#198754; text-decoration:none;">Browse reports</a>
-      </div>
-    </form>
-  </div>
-</body>
-</html>
-""".format(
-        msg_html=msg_html,
-        sel_pb=("selected" if not selected_playbook else ""),
-        playbook_opts=playbook_opts,
-        inv_opts=inv_opts,
-        regions_html=regions_html,
-        hosts_html=hosts_html,
-        user_val=user_val,
-        tags_val=tags_val,
-        check_val=check_val,
-        become_val=become_val,
-    ))
 
 # ---------------- START JOB (background) ----------------
-def start_job(form: cgi.FieldStorage):
+# Runs the playbook from its own directory (so its ansible.cfg is picked up)
+# and stays its parent to record the real exit status. rc is written to a
+# temp name and renamed, so pollers never read it half-written.
+#   $1 = working dir, $2 = rc file, $3... = command
+_RUN_WRAPPER = 'rc_file=$2; cd "$1" && { shift 2; "$@"; }; echo $? > "$rc_file.tmp" && mv -f "$rc_file.tmp" "$rc_file"'
+
+
+def start_job(form: Form):
     playbook_key = form.getfirst("playbook", "")
     inventory_key = form.getfirst("inventory_key", "")
     hosts = form.getlist("hosts")
@@ -495,11 +688,12 @@ def start_job(form: cgi.FieldStorage):
         render_form("Invalid inventory for selected playbook.", form); return
     if not hosts:
         render_form("No hosts selected.", form); return
-    for h in hosts:
-        if not HOST_RE.match(h): render_form("Invalid hostname: %s" % h, form); return
-    if not USER_RE.match(user):
+    bad = first_bad_host(hosts)
+    if bad is not None:
+        render_form("Invalid hostname: %s" % bad, form); return
+    if not is_user(user):
         render_form("Invalid SSH user.", form); return
-    if tags and not TAGS_RE.match(tags):
+    if tags and not is_name_list(tags):
         render_form("Invalid characters in tags.", form); return
 
     playbook_path  = PLAYBOOKS[playbook_key]["path"]
@@ -509,8 +703,7 @@ def start_job(form: cgi.FieldStorage):
     ssh_private_key = PLAYBOOKS[playbook_key].get("ssh_private_key", "")
 
     ensure_dirs()
-    local_tmp = os.path.join(RUN_TMP, "ansible-local")
-    Path(local_tmp).mkdir(parents=True, exist_ok=True)
+    Path(_RUN_ENV["ANSIBLE_LOCAL_TEMP"]).mkdir(parents=True, exist_ok=True)
 
     cmd = [ANSIBLE_BIN, "-i", inventory_path, playbook_path, "--limit", ",".join(hosts), "-u", effective_user]
     if do_check: cmd.append("--check")
@@ -522,16 +715,6 @@ def start_job(form: cgi.FieldStorage):
 
     if USE_SUDO: cmd = [SUDO_BIN, "-n", "--"] + cmd
 
-    env = os.environ.copy()
-    env["LANG"] = "C.UTF-8"
-    env["HOME"] = RUN_HOME
-    env["TMPDIR"] = RUN_TMP
-    env["ANSIBLE_LOCAL_TEMP"] = local_tmp
-    env["ANSIBLE_REMOTE_TMP"] = "/tmp"
-    env["ANSIBLE_HOST_KEY_CHECKING"] = "False"
-    env["ANSIBLE_SSH_ARGS"] = "-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null"
-    env["PYTHONUNBUFFERED"] = "1"
-
     job_id = new_job_id()
     jp = job_paths(job_id)
     Path(jp["dir"]).mkdir(parents=True, exist_ok=True)
@@ -553,36 +736,87 @@ def start_job(form: cgi.FieldStorage):
 
     logf = open(jp["log"], "w", buffering=1, encoding="utf-8", errors="replace")
     try:
+        # An absolute executable, no cwd and close_fds=False let subprocess use
+        # posix_spawn instead of fork()ing this interpreter.
         proc = subprocess.Popen(
-            cmd,
+            [BASH_BIN, "-c", _RUN_WRAPPER, "ansible-run", str(Path(playbook_path).parent), jp["rc"]] + cmd,
             stdout=logf,
             stderr=subprocess.STDOUT,
-            env=env,
-            cwd=Path(playbook_path).parent
+            env=_RUN_ENV,
+            close_fds=False,
         )
     except Exception as e:
         logf.write("Failed to start process: %s\n" % str(e))
         logf.flush()
         logf.close()
         header_ok(); print("<pre>%s</pre>" % safe(str(e))); return
+    logf.close()
 
     meta["pid"] = proc.pid
     write_json(jp["meta"], meta)
 
-    # spawn watcher that writes rc when done (non-blocking approach)
-    with open(os.devnull, "wb") as devnull:
-        subprocess.Popen(
-            ["bash", "-lc", "while kill -0 {pid} 2>/dev/null; do sleep 1; done; echo $? > {rc}".format(pid=proc.pid, rc=quote(jp["rc"]))],
-            stdout=devnull, stderr=devnull
-        )
-
     header_ok()
     print("""<!DOCTYPE html>
 <html><head><meta http-equiv="refresh" content="0; URL=?action=watch&job=%s"></head>
 <body>Starting… <a href="?action=watch&job=%s">Continue</a></body></html>""" % (job_id, job_id))
 
 # ---------------- POLL (tail) ----------------
-def poll_job(form: cgi.FieldStorage):
+def _utf8_complete_len(data: bytes) -> int:
+    """Length of data minus any trailing, incomplete UTF-8 sequence."""
+    n = len(data)
+    for i in range(1, min(4, n) + 1):
+        b = data[n - i]
+        if b < 0x80:
+            return n
+        if b >= 0xC0:
+            need = 2 if b < 0xE0 else (3 if b < 0xF0 else 4)
+            return n if i >= need else n - i
+    return n
+
+
+def _read_log_chunk(path: str, pos: int, final: bool = False):
+    """Read up to MAX_POLL_BYTES of log from pos. Returns (text, new_pos, log_size).
+
+    An incomplete UTF-8 sequence at the end waits for its remaining bytes,
+    except once the job has exited (`final`): it is then decoded as-is.
+    """
+    append = ""
+    sz = 0
+    if pos < 0:
+        pos = 0
+    try:
+        # One stat; the common "nothing new yet" poll stops here without opening the log.
+        sz = os.stat(path).st_size
+        if sz > pos:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                chunk = os.pread(fd, min(sz - pos, MAX_POLL_BYTES), pos)
+            finally:
+                os.close(fd)
+            if not (final and pos + len(chunk) >= sz):
+                chunk = chunk[:_utf8_complete_len(chunk)]
+            try:
+                append = chunk.decode("utf-8")
+            except UnicodeDecodeError:
+                append = chunk.decode("utf-8", "replace")
+            pos += len(chunk)
+    except OSError:
+        pass  # no log yet: report nothing new
+    return append, pos, sz
+
+
+def _read_rc(path: str):
+    """Exit code from rc.txt, or None while the job is still running."""
+    try:
+        with open(path, "rb") as f:
+            return int(f.read().strip() or b"1")
+    except FileNotFoundError:
+        return None
+    except Exception:
+        return 1
+
+
+def poll_job(form: Form):
     header_ok("application/json; charset=utf-8")
     job_id = form.getfirst("job", "")
     try:
@@ -597,61 +831,92 @@ def poll_job(form: cgi.FieldStorage):
     start_ts = meta.get("start_ts", int(time.time()))
     elapsed = int(time.time() - start_ts)
 
-    append = ""
-    try:
-        sz = os.path.getsize(jp["log"]) if os.path.exists(jp["log"]) else 0
-        if pos < 0: pos = 0
-        if sz > pos and os.path.exists(jp["log"]):
-            with open(jp["log"], "r", encoding="utf-8", errors="replace") as f:
-                f.seek(pos)
-                chunk = f.read(128*1024)  # 128KB per poll
-                append = chunk
-                pos = f.tell()
-    except Exception:
-        pass
+    # rc.txt appears only after the playbook has exited, so read it before the
+    # log: the job is done once this read has also reached the end of the log.
+    rc = _read_rc(jp["rc"])
+    append, pos, sz = _read_log_chunk(jp["log"], pos, rc is not None)
+    done = rc is not None and pos >= sz
 
-    rc = None
-    if os.path.exists(jp["rc"]):
-        try:
-            with open(jp["rc"], "r") as f:
-                rc = int((f.read() or "1").strip())
-        except Exception:
-            rc = 1
-        done = True
-    else:
-        pid = meta.get("pid")
-        done = False if (pid and process_running(int(pid))) else False
+    sys.stdout.flush()
+    sys.stdout.buffer.write(json_bytes({"pos": pos, "append": append, "elapsed": elapsed, "done": done, "rc": rc}))
 
-    print(json.dumps({"pos": pos, "append": append, "elapsed": elapsed, "done": bool(rc is not None), "rc": rc}))
 
-# ---------------- WATCH PAGE ----------------
-def render_watch(form: cgi.FieldStorage):
-    job_id = form.getfirst("job", "")
-    if not job_id:
-        header_ok(); print("<pre>Missing job id.</pre>"); return
-    jp = job_paths(job_id)
-    if not os.path.isdir(jp["dir"]):
-        header_ok(); print("<pre>Unknown job.</pre>"); return
+# ---------------- STREAM (Server-Sent Events) ----------------
+STREAM_MAX_SECS = 300      # end a stream after this long; the page reconnects from pos
+STREAM_INTERVAL_SECS = 0.5  # poll interval when inotify_simple is not installed
+STREAM_KEEPALIVE_SECS = 15
 
-    meta = read_json(jp["meta"], {})
-    start_ts = meta.get("start_ts", int(time.time()))
 
-    now = int(time.time())
-    two_hours_ago = now - 2*3600
-    since_ts = start_ts if start_ts >= two_hours_ago else two_hours_ago
+def _dir_watcher(path: str):
+    """inotify watch on a job dir (log appends, rc.txt rename), or None if unavailable."""
+    if inotify_simple is None:
+        return None
+    try:
+        ino = inotify_simple.INotify()
+        f = inotify_simple.flags
+        ino.add_watch(path, f.MODIFY | f.CLOSE_WRITE | f.CREATE | f.MOVED_TO)
+        return ino
+    except OSError:
+        return None
 
-    fresh_reports = find_reports(since_ts=since_ts, host_filter="")
-    fresh_links = []
-    for r in fresh_reports:
-        link = "?action=view_report&base={}&rel={}".format(
-            quote(r["base"]), quote(r["rel"])
-        )
-        fresh_links.append("<li><a href='{}' target='_blank'>{}</a> — {}</li>".format(link, safe(r["file"]),
-                                                                                   time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(r["mtime"]))))
 
-    # Render watch page (static fresh reports snapshot included)
-    header_ok()
-    print("""<!DOCTYPE html>
+def iter_job_events(job_id: str, pos: int = 0):
+    """Yield SSE frames (bytes) carrying poll-style updates until the job is done."""
+    jp = job_paths(job_id)
+    if not os.path.isdir(jp["dir"]):
+        yield b'data: {"error": "no-such-job"}\n\n'
+        return
+    start_ts = read_json(jp["meta"], {}).get("start_ts", int(time.time()))
+    deadline = time.time() + STREAM_MAX_SECS
+    last_sent = time.time()
+    watcher = _dir_watcher(jp["dir"])
+    try:
+        while True:
+            rc = _read_rc(jp["rc"])  # before the log, as in poll_job
+            prev = pos
+            append, pos, sz = _read_log_chunk(jp["log"], pos, rc is not None)
+            done = rc is not None and pos >= sz
+            now = time.time()
+            if append or done:
+                event = {"pos": pos, "append": append, "elapsed": int(now - start_ts), "done": done, "rc": rc}
+                yield b"data: " + json_bytes(event) + b"\n\n"
+                last_sent = now
+            elif now - last_sent >= STREAM_KEEPALIVE_SECS:
+                yield b": keepalive\n\n"
+                last_sent = now
+            if done or now >= deadline:
+                return
+            if prev < pos < sz:
+                continue  # progress, and more already written: send it without waiting
+            if watcher is not None:
+                # Sleep until the job dir changes; wake for the keepalive at the latest.
+                watcher.read(timeout=int(STREAM_KEEPALIVE_SECS * 1000), read_delay=50)
+            else:
+                time.sleep(STREAM_INTERVAL_SECS)
+    finally:
+        if watcher is not None:
+            watcher.close()
+
+
+def stream_job(form: Form):
+    print("Content-Type: text/event-stream; charset=utf-8")
+    print("Cache-Control: no-cache")
+    print()
+    sys.stdout.flush()
+    try:
+        pos = int(form.getfirst("pos", "0"))
+    except Exception:
+        pos = 0
+    out = sys.stdout.buffer
+    try:
+        for frame in iter_job_events(form.getfirst("job", ""), pos):
+            out.write(frame)
+            out.flush()
+    except (BrokenPipeError, ConnectionResetError):
+        pass  # browser went away
+
+# ---------------- WATCH PAGE ----------------
+_WATCH_HEAD = """<!DOCTYPE html>
 <html>
 <head>
   <meta charset="utf-8" />
@@ -660,9 +925,9 @@ def render_watch(form: cgi.FieldStorage):
     body { font-family: system-ui, -apple-system, Segoe UI, Roboto, Arial, sans-serif; margin: 24px; }
     .card { max-width: 1000px; margin: auto; padding: 20px; border: 1px solid #ddd; border-radius: 12px; box-shadow: 0 2px 6px rgba(0,0,0,.05); }
     .barwrap { height: 8px; background:#eee; border-radius: 999px; overflow:hidden; margin:12px 0 18px; }
-    .bar { width:35%%; height:100%%; background:#0d6efd; animation: indet 1.5s infinite ease-in-out; }
-    @keyframes indet { 0%%{transform:translateX(-100%%)} 50%%{transform:translateX(30%%)} 100%%{transform:translateX(100%%)} }
-    .spinner { width:18px; height:18px; border:3px solid #0d6efd55; border-top-color:#0d6efd; border-radius:50%%; animation: spin .8s linear infinite; display:inline-block; vertical-align:middle; margin-right:8px; }
+    .bar { width:35%; height:100%; background:#0d6efd; animation: indet 1.5s infinite ease-in-out; }
+    @keyframes indet { 0%{transform:translateX(-100%)} 50%{transform:translateX(30%)} 100%{transform:translateX(100%)} }
+    .spinner { width:18px; height:18px; border:3px solid #0d6efd55; border-top-color:#0d6efd; border-radius:50%; animation: spin .8s linear infinite; display:inline-block; vertical-align:middle; margin-right:8px; }
     @keyframes spin { to { transform: rotate(360deg); } }
     pre { background:#0b1020; color:#d1e7ff; padding:12px; border-radius:8px; white-space:pre-wrap; max-height:520px; overflow:auto; }
     .muted { color:#666; }
@@ -671,26 +936,25 @@ def render_watch(form: cgi.FieldStorage):
   </style>
 </head>
 <body>
-  <div class="card">
-    <h1 id="title"><span class="spinner"></span>Running…</h1>
-    <div class="barwrap"><div class="bar"></div></div>
-    <div class="muted" id="elapsed">Elapsed: 0s</div>
-    <pre id="log">(connecting…)</pre>
-    <div class="actions" id="actions" style="display:none">
-      <a class="btn" href="">Run another</a>
-      <a class="btn" href="?action=list_reports" target="_blank">Browse reports</a>
-    </div>
-    <div id="fresh_reports" style="margin-top:16px;">
-      <h3>Recent Reports (static snapshot)</h3>
-      <ul>
-        {fresh}
-      </ul>
-    </div>
-  </div>
-<script>
-  var job = {job_json};
-  var pos = 0;
+"""
+_WATCH_SCRIPT = """  var pos = 0;
   var done = false;
+  function update(r) {
+    pos = r.pos;
+    document.getElementById('elapsed').textContent = 'Elapsed: ' + r.elapsed + 's';
+    if (r.append) {
+      var pre = document.getElementById('log');
+      pre.textContent += r.append;
+      pre.scrollTop = pre.scrollHeight;
+    }
+    if (r.done) {
+      done = true;
+      document.getElementById('title').textContent = r.rc === 0 ? '✅ SUCCESS' : ('❌ FAILED (rc=' + r.rc + ')');
+      document.querySelector('.barwrap').style.display = 'none';
+      document.querySelector('.spinner').style.display = 'none';
+      document.getElementById('actions').style.display = 'flex';
+    }
+  }
   function poll() {
     if (done) return;
     var xhr = new XMLHttpRequest();
@@ -699,22 +963,8 @@ def render_watch(form: cgi.FieldStorage):
       if (xhr.readyState === 4 && xhr.status === 200) {
         try {
           var r = JSON.parse(xhr.responseText);
-          pos = r.pos;
-          document.getElementById('elapsed').textContent = 'Elapsed: ' + r.elapsed + 's';
-          if (r.append) {
-            var pre = document.getElementById('log');
-            pre.textContent += r.append;
-            pre.scrollTop = pre.scrollHeight;
-          }
-          if (r.done) {
-            done = true;
-            document.getElementById('title').textContent = r.rc === 0 ? '✅ SUCCESS' : ('❌ FAILED (rc=' + r.rc + ')');
-            document.querySelector('.barwrap').style.display = 'none';
-            document.querySelector('.spinner').style.display = 'none';
-            document.getElementById('actions').style.display = 'flex';
-          } else {
-            setTimeout(poll, 2000);
-          }
+          update(r);
+          if (!r.done) setTimeout(poll, 2000);
         } catch (e) {
           setTimeout(poll, 3000);
         }
@@ -724,16 +974,81 @@ def render_watch(form: cgi.FieldStorage):
     };
     xhr.send();
   }
-  poll();
+  function stream() {
+    var es = new EventSource('?action=stream&job=' + encodeURIComponent(job) + '&pos=' + pos);
+    es.onmessage = function(ev) {
+      var r = JSON.parse(ev.data);
+      if (r.error) { es.close(); return; }
+      update(r);
+      if (r.done) es.close();
+    };
+    es.onerror = function() {
+      // server ended the stream (time limit) or the connection dropped: resume from pos
+      es.close();
+      if (!done) setTimeout(stream, 2000);
+    };
+  }
+  if (window.EventSource) stream(); else poll();
 </script>
-</body></html>""".format(fresh="\n".join(fresh_links), job_json=json.dumps(job_id))
+</body></html>
+"""
+
+
+def render_watch(form: Form):
+    job_id = form.getfirst("job", "")
+    if not job_id:
+        header_ok(); print("<pre>Missing job id.</pre>"); return
+    jp = job_paths(job_id)
+    if not os.path.isdir(jp["dir"]):
+        header_ok(); print("<pre>Unknown job.</pre>"); return
+
+    meta = read_json(jp["meta"], {})
+    start_ts = meta.get("start_ts", int(time.time()))
+
+    now = int(time.time())
+    two_hours_ago = now - 2*3600
+    since_ts = start_ts if start_ts >= two_hours_ago else two_hours_ago
+
+    fresh_reports = find_reports(since_ts=since_ts, host_filter="", max_results=WATCH_MAX_REPORTS)
+    fresh_links = []
+    for r in fresh_reports:
+        fresh_links.append("<li><a href='{}' target='_blank'>{}</a> — {}</li>".format(r["link"], safe(r["file"]),
+                                                                                   r["mtime_str"]))
+
+    # Render watch page (static fresh reports snapshot included)
+    header_ok()
+    out = sys.stdout
+    out.write(_WATCH_HEAD)
+    out.write("""  <div class="card">
+    <h1 id="title"><span class="spinner"></span>Running…</h1>
+    <div class="barwrap"><div class="bar"></div></div>
+    <div class="muted" id="elapsed">Elapsed: 0s</div>
+    <pre id="log">(connecting…)</pre>
+    <div class="actions" id="actions" style="display:none">
+      <a class="btn" href="">Run another</a>
+      <a class="btn" href="?action=list_reports" target="_blank">Browse reports</a>
+    </div>
+    <div id="fresh_reports" style="margin-top:16px;">
+      <h3>Recent Reports (static snapshot)</h3>
+      <ul>
+        %s
+      </ul>
+    </div>
+  </div>
+<script>
+  var job = %s;
+""" % ("\n".join(fresh_links), json.dumps(job_id)))
+    out.write(_WATCH_SCRIPT)
+    out.flush()
+
 
 # ---------------- MAIN ----------------
-def main():
+def handle(method: str, form: Form | None):
+    """Dispatch one request; handlers write a CGI-style response to stdout."""
+    if form is None:
+        print("Status: 413 Request Entity Too Large")
+        header_ok(); print("<pre>Request too large.</pre>"); return
     try:
-        method = os.environ.get("REQUEST_METHOD", "GET").upper()
-        form = cgi.FieldStorage()
-
         action = form.getfirst("action", "")
         if method == "POST" and action == "start":
             start_job(form)
@@ -741,6 +1056,8 @@ def main():
             render_watch(form)
         elif method == "GET" and action == "poll":
             poll_job(form)
+        elif method == "GET" and action == "stream":
+            stream_job(form)
         elif method == "GET" and action == "list_reports":
             render_list_reports(form)
         elif method == "GET" and action == "view_report":
@@ -753,5 +1070,78 @@ def main():
         print("<pre>%s</pre>" % safe(traceback.format_exc()))
 
 
+def main():
+    method = os.environ.get("REQUEST_METHOD", "GET").upper()
+    handle(method, parse_form(os.environ, sys.stdin.buffer))
+
+
+class _ThreadStdout(object):
+    """sys.stdout stand-in that sends writes to a per-thread capture stream."""
+
+    def __init__(self, default):
+        self._default = default
+        self._local = threading.local()
+
+    def capture(self, stream):
+        self._local.stream = stream
+
+    def __getattr__(self, name):
+        return getattr(getattr(self._local, "stream", None) or self._default, name)
+
+
+def application(environ, start_response):
+    """WSGI entry point.
+
+    Handlers print CGI output, so stdout is captured per thread for the request
+    and the leading header block is split off into the WSGI status/headers.
+    """
+    if not isinstance(sys.stdout, _ThreadStdout):
+        sys.stdout = _ThreadStdout(sys.stdout)
+    method = environ.get("REQUEST_METHOD", "GET").upper()
+    form = parse_form(environ, environ["wsgi.input"])
+
+    if form is not None and method == "GET" and form.getfirst("action") == "stream":
+        # Long-lived response: hand the frame generator to the server unbuffered.
+        try:
+            pos = int(form.getfirst("pos", "0"))
+        except Exception:
+            pos = 0
+        start_response("200 OK", [
+            ("Content-Type", "text/event-stream; charset=utf-8"),
+            ("Cache-Control", "no-cache"),
+        ])
+        return iter_job_events(form.getfirst("job", ""), pos)
+
+    buf = io.BytesIO()
+    out = io.TextIOWrapper(buf, encoding="utf-8", write_through=True)
+    sys.stdout.capture(out)
+    try:
+        handle(method, form)
+        out.flush()
+    finally:
+        sys.stdout.capture(None)
+    raw = buf.getvalue()
+    out.detach()
+
+    head, sep, body = raw.partition(b"\n\n")
+    if not sep:
+        head, body = b"", raw
+    status = "200 OK"
+    headers = []
+    for line in head.decode("latin-1").splitlines():
+        name, _, value = line.partition(":")
+        if name.strip().lower() == "status":
+            status = value.strip()
+        elif name.strip().lower() == "content-length":
+            continue  # recomputed from the captured body below
+        elif name.strip():
+            headers.append((name.strip(), value.strip()))
+    if not headers:
+        headers.append(("Content-Type", "text/html; charset=utf-8"))
+    headers.append(("Content-Length", str(len(body))))
+    start_response(status, headers)
+    return [body]
+
+
 if __name__ == "__main__":
     main()
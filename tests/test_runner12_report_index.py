@@ -0,0 +1,163 @@
+import enum
+import importlib.util
+import os
+import tempfile
+import time
+import types
+import unittest
+from collections import namedtuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_runner12():
+    spec = importlib.util.spec_from_file_location("runner12", os.path.join(HERE, os.pardir, "runner12.py"))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+class ReportIndexTest(unittest.TestCase):
+    """The shared report index, laid out as shipped: the index inside a report base."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        base = self.tmp.name
+        r = self.r = load_runner12()
+        r.REPORT_BASES = [base]
+        r.RUN_TMP = os.path.join(base, "www-ansible", "tmp")
+        r.REPORT_INDEX_PATH = os.path.join(r.RUN_TMP, "report_index.json")
+        r._PRIVATE_DIRS = (r.RUN_TMP + "/",)
+        os.makedirs(r.RUN_TMP)  # as ensure_dirs() leaves it
+        os.makedirs(os.path.join(base, "host1"))
+        self.touch("host1/web1.html")
+        self.touch("top.html")
+
+        self.full_scans = 0
+        scan = r._scan
+
+        def counting_scan(base, top, *args):
+            if top == base:
+                self.full_scans += 1
+            return scan(base, top, *args)
+        r._scan = counting_scan
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def touch(self, rel):
+        with open(os.path.join(self.tmp.name, rel), "w") as f:
+            f.write("<html></html>")
+
+    def names(self):
+        return sorted(r["rel"] for r in self.r.find_reports())
+
+    def test_second_call_is_a_cache_hit(self):
+        self.assertEqual(self.names(), ["host1/web1.html", "top.html"])
+        self.assertEqual(self.names(), ["host1/web1.html", "top.html"])
+        self.assertEqual(self.full_scans, 1)
+        self.assertTrue(os.path.exists(self.r.REPORT_INDEX_PATH))
+
+    def test_new_report_in_a_subdirectory_rebuilds(self):
+        self.names()
+        time.sleep(0.01)  # a distinct directory mtime_ns
+        self.touch("host1/db1.html")
+        self.assertEqual(self.names(), ["host1/db1.html", "host1/web1.html", "top.html"])
+        self.assertEqual(self.full_scans, 2)
+
+    def test_private_dirs_are_not_listed(self):
+        self.touch("www-ansible/tmp/secret.html")
+        self.assertNotIn("www-ansible/tmp/secret.html", self.names())
+
+
+class _Flags(enum.IntFlag):
+    ATTRIB = 0x4
+    CLOSE_WRITE = 0x8
+    MOVED_FROM = 0x40
+    MOVED_TO = 0x80
+    CREATE = 0x100
+    DELETE = 0x200
+    Q_OVERFLOW = 0x4000
+    IGNORED = 0x8000
+    ISDIR = 0x40000000
+
+
+_Event = namedtuple("_Event", "wd mask cookie name")
+
+
+class _StopIndexer(Exception):
+    pass
+
+
+class _ScriptedINotify(object):
+    """inotify_simple.INotify stand-in: each read() runs the next step of a script."""
+
+    def __init__(self, steps):
+        self.steps = list(steps)
+        self.watched = {}  # path -> wd
+
+    def add_watch(self, path, mask):
+        return self.watched.setdefault(path, len(self.watched) + 1)
+
+    def rm_watch(self, wd):
+        pass
+
+    def read(self, timeout=None, read_delay=None):
+        if not self.steps:
+            raise _StopIndexer()
+        return self.steps.pop(0)(self)
+
+
+class IndexerTest(unittest.TestCase):
+    """index_reports_forever() driven by scripted inotify events."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        base = self.base = self.tmp.name
+        r = self.r = load_runner12()
+        r.REPORT_BASES = [base]
+        r.RUN_TMP = os.path.join(base, "www-ansible", "tmp")
+        r.JOB_DIR = os.path.join(base, "www-ansible", "jobs")
+        r.REPORT_INDEX_PATH = os.path.join(r.RUN_TMP, "report_index.json")
+        r._PRIVATE_DIRS = (r.RUN_TMP + "/", r.JOB_DIR + "/")
+        os.makedirs(r.RUN_TMP)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_indexer(self, *steps):
+        ino = _ScriptedINotify(steps)
+        self.r.inotify_simple = types.SimpleNamespace(flags=_Flags, INotify=lambda: ino)
+        with self.assertRaises(_StopIndexer):
+            self.r.index_reports_forever()
+        return ino
+
+    def test_private_dir_created_later_is_not_indexed_or_watched(self):
+        parent = os.path.dirname(self.r.JOB_DIR)
+
+        def first_job(ino):
+            os.makedirs(os.path.join(self.r.JOB_DIR, "job1"))
+            with open(os.path.join(self.r.JOB_DIR, "job1", "out.html"), "w") as f:
+                f.write("<html></html>")
+            return [_Event(ino.watched[parent], _Flags.CREATE | _Flags.ISDIR, 0, "jobs")]
+
+        ino = self.run_indexer(first_job)
+        self.assertNotIn(self.r.JOB_DIR, ino.watched)
+        index = self.r.read_json(self.r.REPORT_INDEX_PATH)
+        self.assertEqual(index["entries"], [])
+
+    def test_new_public_dir_is_indexed(self):
+        def new_dir(ino):
+            os.makedirs(os.path.join(self.base, "host2"))
+            with open(os.path.join(self.base, "host2", "web2.html"), "w") as f:
+                f.write("<html></html>")
+            return [_Event(ino.watched[self.base], _Flags.CREATE | _Flags.ISDIR, 0, "host2")]
+
+        ino = self.run_indexer(new_dir)
+        self.assertIn(os.path.join(self.base, "host2"), ino.watched)
+        index = self.r.read_json(self.r.REPORT_INDEX_PATH)
+        self.assertEqual([e["rel"] for e in index["entries"]], ["host2/web2.html"])
+
+
+if __name__ == "__main__":
+    unittest.main()